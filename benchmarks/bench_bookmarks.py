@@ -0,0 +1,139 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Recursive bookmark flattening vs. the explicit-stack walkers
+
+Time and peak memory (tracemalloc) of flattening an already parsed
+Chromium and Safari bookmark tree. Both implementations must return the
+same records. Finally the cold load of three bookmark files one after
+another vs. load_all_bookmarks().
+
+Usage: python benchmarks/bench_bookmarks.py [bookmarks] [depth]
+"""
+import json
+import os
+import plistlib
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import fixtures
+
+os.environ.setdefault("show_favicon", "0")
+from browser_config import BOOKMARKS_MAP  # noqa: E402
+
+for k in BOOKMARKS_MAP:
+    os.environ.setdefault(k, "0")
+import chrom_bookmarks  # noqa: E402
+
+
+def legacy_chromium(the_json: dict, browser: str) -> list:
+    def extract_data(data: dict, path: list):
+        if isinstance(data, dict) and data.get('type') == 'url':
+            folder_path = ' > '.join(path) if path else 'Root'
+            urls.append({
+                'name': data.get('name'),
+                'url': data.get('url'),
+                'path': folder_path
+            })
+        if isinstance(data, dict) and data.get('type') == 'folder':
+            folder_name = data.get('name', 'Unnamed Folder')
+            the_children = data.get('children')
+            new_path = path + [folder_name]
+            get_container(the_children, new_path)
+
+    def get_container(o, path: list = []):
+        if isinstance(o, list):
+            for i in o:
+                extract_data(i, path)
+        if isinstance(o, dict):
+            for k, i in o.items():
+                container_name = k.replace('_', ' ').title() if k not in [
+                    'children'] else ''
+                if container_name and isinstance(i, dict) and i.get('type') == 'folder':
+                    extract_data(i, [container_name]
+                                 if container_name else path)
+                else:
+                    extract_data(i, path)
+
+    urls = list()
+    get_container(the_json)
+    s_list_dict = sorted(urls, key=lambda k: k['name'], reverse=False)
+    return [(l.get('name'), l.get('url'), l.get('path'), browser)
+            for l in s_list_dict]
+
+
+def legacy_safari(bookmark_data, bookmarks_list, path=[], browser="safari") -> None:
+    if isinstance(bookmark_data, list):
+        for item in bookmark_data:
+            legacy_safari(item, bookmarks_list, path, browser)
+    elif isinstance(bookmark_data, dict):
+        if "Children" in bookmark_data:
+            folder_name = bookmark_data.get("Title", "")
+            new_path = path + [folder_name] if folder_name else path
+            legacy_safari(
+                bookmark_data["Children"], bookmarks_list, new_path, browser)
+        elif "URLString" in bookmark_data and "URIDictionary" in bookmark_data:
+            title = bookmark_data["URIDictionary"].get("title", "Untitled")
+            url = bookmark_data["URLString"]
+            folder_path = ' > '.join(path) if path else 'Root'
+            bookmarks_list.append((title, url, folder_path, browser))
+
+
+def legacy_safari_list(plist, browser: str) -> list:
+    bookmarks = []
+    legacy_safari(plist, bookmarks, [], browser)
+    return bookmarks
+
+
+def measure(name: str, func, *args) -> list:
+    start = time.perf_counter()
+    res = func(*args)
+    elapsed = (time.perf_counter() - start) * 1000
+    # second run for the memory, tracemalloc slows down the first
+    del res
+    tracemalloc.start()
+    res = func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<20} {elapsed:9.1f} ms {peak / 1024 ** 2:9.1f} MiB peak")
+    return res
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    depth = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    with tempfile.TemporaryDirectory() as tmp:
+        chromium = fixtures.chromium_bookmarks(os.path.join(tmp, "Bookmarks"), count, depth)
+        safari = fixtures.safari_bookmarks(os.path.join(tmp, "Bookmarks.plist"), count, depth)
+        with open(chromium) as f:
+            roots = json.load(f)["roots"]
+        with open(safari, "rb") as f:
+            plist = plistlib.load(f)
+    print(f"{count} bookmarks in {depth} folder levels")
+    old = measure("chromium recursive", legacy_chromium, roots, "chrome")
+    new = measure("chromium stack", chrom_bookmarks.get_all_urls, roots, "chrome")
+    assert old == new, "chromium records differ"
+    old = measure("safari recursive", legacy_safari_list, plist, "safari")
+    new = measure("safari stack", lambda *a: list(chrom_bookmarks.iter_safari_bookmarks(*a)), plist, "safari")
+    assert old == new, "safari records differ"
+    with tempfile.TemporaryDirectory() as home:
+        os.environ["alfred_workflow_cache"] = home
+        files = list()
+        for browser in ("chrome", "brave", "safari"):
+            f = os.path.join(home, BOOKMARKS_MAP[browser])
+            os.makedirs(os.path.dirname(f), exist_ok=True)
+            create = fixtures.safari_bookmarks if browser == "safari" else fixtures.chromium_bookmarks
+            files.append(create(f, count, depth))
+        start = time.perf_counter()
+        old = [chrom_bookmarks.parse_bookmarks(f)[1] for f in files]
+        print(f"{'3 files sequential':<20} {(time.perf_counter() - start) * 1000:9.1f} ms")
+        start = time.perf_counter()
+        new = chrom_bookmarks.load_all_bookmarks(files)
+        print(f"{'3 files parallel':<20} {(time.perf_counter() - start) * 1000:9.1f} ms")
+        assert old == new, "loaded records differ"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Stress test of concurrent invocations rebuilding the same cached state
+
+Starts many processes at once which
+- run chrom_history.py on a cold cache (all need the same mirror sync),
+- fetch the same favicons from a local stand-in for the favicon service,
+- build the same trigram index while others read it,
+and checks that every piece of work is done once, waiters reuse its
+result and no reader sees a torn file.
+
+Usage: python benchmarks/bench_concurrency.py [processes]
+Exits with 1 if a check fails.
+"""
+import http.server
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import fixtures
+import Favicon
+import trigram
+
+
+class StandIn(http.server.BaseHTTPRequestHandler):
+    requests = 0
+
+    def do_GET(self):
+        StandIn.requests += 1
+        # slow enough that all fetchers overlap
+        time.sleep(0.1)
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(b"\x89PNG" * 256)
+
+    def log_message(self, *args):
+        pass
+
+
+def report(name: str, ok: bool, detail: str) -> bool:
+    print(f"{'OK  ' if ok else 'FAIL'} {name:<16} {detail}")
+    return ok
+
+
+def history_runs(processes: int, tmp: str) -> bool:
+    home = fixtures.workflow_home(os.path.join(tmp, "home"), rows=50000, bookmarks=10)
+    env = fixtures.workflow_env(home, os.path.join(tmp, "cache"))
+    env.update({"search_budget_ms": "0", "instant_results": "0"})
+    os.makedirs(env["alfred_workflow_cache"])
+    start = time.perf_counter()
+    procs = [subprocess.Popen([sys.executable, "chrom_history.py", "git"], cwd=fixtures.SRC_DIR, env=env,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+             for _ in range(processes)]
+    results = [p.communicate() for p in procs]
+    elapsed = (time.perf_counter() - start) * 1000
+    syncs = sum(err.count("Mirror of chrome synced:") for _, err in results)
+    # Superseded runs exit without output, all others show the same items
+    outputs = {out for out, _ in results if out}
+    failed = [p.returncode for p in procs if p.returncode]
+    items = len(json.loads(next(iter(outputs)))["items"]) if len(outputs) == 1 else 0
+    return report("history sync", syncs == 1 and len(outputs) == 1 and items and not failed,
+                  f"{elapsed:8.1f} ms {syncs:4} syncs {len(outputs):4} distinct outputs, {items} items, "
+                  f"{len(failed)} failed runs")
+
+
+def fetch(args: tuple) -> None:
+    netlocs, cache_dir = args
+    Favicon.fetch_favicons(netlocs, cache_dir)
+
+
+def favicon_fetchers(processes: int, tmp: str) -> bool:
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    Favicon.FAVICON_URL = f"http://127.0.0.1:{server.server_port}/favicons?domain={{netloc}}"
+    cache_dir = os.path.join(tmp, "favicons")
+    os.makedirs(cache_dir)
+    os.environ["alfred_workflow_cache"] = cache_dir
+    netlocs = [f"site{i}.example.com" for i in range(20)]
+    start = time.perf_counter()
+    # fork keeps the patched FAVICON_URL in the fetchers
+    with multiprocessing.get_context("fork").Pool(processes) as pool:
+        pool.map(fetch, [(netlocs, cache_dir)] * processes)
+    elapsed = (time.perf_counter() - start) * 1000
+    server.shutdown()
+    sizes = {os.path.getsize(os.path.join(cache_dir, f"{n}.png")) for n in netlocs}
+    manifest = Favicon.FaviconManifest(cache_dir)
+    recorded = manifest.load(netlocs)
+    manifest.close()
+    complete = len(recorded) == len(netlocs) and all(e[1] == 1024 for e in recorded.values())
+    locks = [f for f in os.listdir(cache_dir) if f.endswith(".lock")]
+    return report("favicon fetch", StandIn.requests == len(netlocs) and sizes == {1024} and complete and len(locks) == 1,
+                  f"{elapsed:8.1f} ms {StandIn.requests:4} requests for {len(netlocs)} icons, "
+                  f"sizes {sorted(sizes)}, manifest {'complete' if complete else 'incomplete'}, {len(locks)} lock files")
+
+
+def build(path: str) -> bool:
+    rows = ((i, f"{fixtures.WORDS[i % len(fixtures.WORDS)]} page {i}") for i in range(200000))
+    return trigram.write_index(path, rows, ("stress", 200000))
+
+
+def read(path: str) -> int:
+    torn = 0
+    deadline = time.time() + 2
+    while time.time() < deadline:
+        try:
+            index = trigram.TrigramIndex.open(path)
+        except Exception:
+            torn += 1
+            continue
+        if index is not None:
+            if index.meta != ("stress", 200000) or not index.candidates("git"):
+                torn += 1
+            index.close()
+    return torn
+
+
+def index_builders(processes: int, tmp: str) -> bool:
+    path = os.path.join(tmp, "stress.trigrams")
+    start = time.perf_counter()
+    with multiprocessing.get_context("fork").Pool(processes * 2) as pool:
+        readers = pool.map_async(read, [path] * processes)
+        built = pool.map(build, [path] * processes)
+        torn = sum(readers.get())
+    elapsed = (time.perf_counter() - start) * 1000
+    leftovers = [f for f in os.listdir(tmp) if f.startswith("stress.trigrams.") and f != "stress.trigrams.lock"]
+    return report("trigram build", sum(built) >= 1 and not torn and not leftovers,
+                  f"{elapsed:8.1f} ms {sum(built):4} builds {len(built) - sum(built):4} left to a builder, "
+                  f"{torn} torn reads, {len(leftovers)} leftover files")
+
+
+def main():
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    print(f"{processes} concurrent processes per check")
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp:
+        ok &= history_runs(processes, tmp)
+        ok &= favicon_fetchers(processes, tmp)
+        ok &= index_builders(processes, tmp)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
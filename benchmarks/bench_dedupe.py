@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+History of several browsers without the mirror: one query per browser in a
+thread pool with dedupe, sort and limit in Python vs. a single statement
+over all History files attached to one connection
+
+Both must return entries with the same ranking.
+
+Usage: python benchmarks/bench_dedupe.py [rows] 2>/dev/null
+"""
+import os
+import sys
+import tempfile
+import time
+from multiprocessing.pool import ThreadPool as Pool
+
+import fixtures
+
+# chrom_history reads its settings on import, the History files are passed explicitly
+os.environ.update(fixtures.workflow_env(tempfile.gettempdir(), tempfile.gettempdir()))
+import chrom_history  # noqa: E402
+from Alfred3 import Tools  # noqa: E402
+
+QUERIES = ("", "git", "github python", "maps|wiki")
+# chrome and brave share their urls
+SEEDS = (("chrome", 1), ("brave", 1), ("edge", 2))
+
+
+def read(pairs: list, sql_filter, limit: int) -> list:
+    # sql() is a generator, drain it in the worker
+    return list(chrom_history.sql(pairs, sql_filter, limit))
+
+
+def legacy(pairs: list, sql_filter) -> list:
+    limit = None if chrom_history.sort_recent else chrom_history.RESULT_LIMIT
+    with Pool(len(pairs)) as p:
+        results = p.starmap(read, [([pair], sql_filter, limit) for pair in pairs])
+    matches = chrom_history.removeDuplicates([e for r in results for e in r])
+    return Tools.sortListTuple(matches, 3 if chrom_history.sort_recent else 2)[:chrom_history.RESULT_LIMIT]
+
+
+def attached(pairs: list, sql_filter) -> list:
+    return list(chrom_history.sql(pairs, sql_filter, chrom_history.RESULT_LIMIT))
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    with tempfile.TemporaryDirectory() as tmp:
+        pairs = list()
+        for browser, seed in SEEDS:
+            os.mkdir(os.path.join(tmp, browser))
+            pairs.append((fixtures.chromium_history(os.path.join(tmp, browser, "History"), rows, seed=seed), browser))
+        print(f"{len(pairs)} History files with {rows} urls each")
+        print(f"{'query':<16} {'sort':<7} {'pool':>10} {'attached':>10}")
+        for sort_recent in (False, True):
+            chrom_history.sort_recent = sort_recent
+            for query in QUERIES:
+                sql_filter = chrom_history.get_sql_filter(query)
+                start = time.perf_counter()
+                old = legacy(pairs, sql_filter)
+                t_old = time.perf_counter() - start
+                start = time.perf_counter()
+                new = attached(pairs, sql_filter)
+                t_new = time.perf_counter() - start
+                key = 3 if sort_recent else 2
+                assert [e[key] for e in old] == [e[key] for e in new], f"ranking differs for {query!r}"
+                print(f"{query!r:<16} {'recent' if sort_recent else 'visits':<7} "
+                      f"{t_old * 1000:8.1f}ms {t_new * 1000:8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Favicon fetcher against a local stand-in for the favicon service
+
+The stand-in answers with an icon, a HTTP error or not at all (timeout)
+depending on the requested domain. Every sixth domain has its icon in a
+Chrome Favicons database. Reports local icons, network round trips and
+time of two consecutive fetch rounds and of the Script Filter hot path.
+
+Checks that failed lookups are recorded with a retry time in the future,
+that the backoff doubles on a repeated failure, that the second round
+makes no request and that local hosts never reach the favicon service.
+
+Usage: python benchmarks/bench_favicon.py [domains]
+Exits with 1 if a check fails.
+"""
+import http.server
+import os
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+import fixtures
+import Favicon
+from browser_config import HISTORY_MAP
+
+
+class StandIn(http.server.BaseHTTPRequestHandler):
+    requests = 0
+    domains = list()
+
+    def do_GET(self):
+        StandIn.requests += 1
+        domain = parse_qs(urlparse(self.path).query)["domain"][0]
+        StandIn.domains.append(domain)
+        if domain.startswith("slow"):
+            # client gives up before the answer
+            time.sleep(Favicon.REQUEST_TIMEOUT * 2)
+            return
+        if domain.startswith("bad"):
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(b"\x89PNG")
+
+    def log_message(self, *args):
+        pass
+
+
+def fetch_round(name: str, netlocs: list, cache_dir: str) -> int:
+    requests = StandIn.requests
+    start = time.perf_counter()
+    Favicon.fetch_favicons(netlocs, cache_dir)
+    print(f"{name:<14} {(time.perf_counter() - start) * 1000:8.1f} ms {StandIn.requests - requests:6} requests")
+    return StandIn.requests - requests
+
+
+def report(name: str, ok: bool, detail: str) -> bool:
+    print(f"{'OK  ' if ok else 'FAIL'} {name:<16} {detail}")
+    return ok
+
+
+def failures(cache_dir: str, netlocs: list) -> dict:
+    """
+    Seconds until the failed lookups are retried
+
+    Returns:
+        dict: netloc and backoff, None if no failure is recorded
+    """
+    manifest = Favicon.FaviconManifest(cache_dir)
+    entries = manifest.load(netlocs)
+    manifest.close()
+    now = time.time()
+    return {n: entries[n][4] - now if n in entries and entries[n][3] == "failed" else None for n in netlocs}
+
+
+def retry_now(cache_dir: str, netloc: str) -> None:
+    manifest = Favicon.FaviconManifest(cache_dir)
+    with manifest.con:
+        manifest.con.execute("UPDATE icons SET retry_after = 0 WHERE netloc = ?", (netloc,))
+    manifest.close()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    Favicon.FAVICON_URL = f"http://127.0.0.1:{server.server_port}/favicons?domain={{netloc}}"
+    Favicon.REQUEST_TIMEOUT = 0.5
+    netlocs = [f"{('ok', 'bad', 'slow')[i % 3]}{i}.example.com" for i in range(count)]
+    local_hosts = ["localhost:8080", "192.168.1.1", "intranet"]
+    urls = [(f"https://{n}/page", "title") for n in netlocs + local_hosts]
+    with tempfile.TemporaryDirectory() as cache_dir, tempfile.TemporaryDirectory() as home:
+        os.environ.update({"alfred_workflow_cache": cache_dir, "HOME": home, "chrome": "1"})
+        favicons = os.path.join(home, os.path.dirname(HISTORY_MAP["chrome"]), "Favicons")
+        os.makedirs(os.path.dirname(favicons))
+        fixtures.chromium_favicons(favicons, [u for u, _ in urls[::6]])
+        started = list()
+        Favicon.fetch_in_background = started.extend
+        print(f"{count} domains, 1/3 each answering, failing, timing out")
+        start = time.perf_counter()
+        Favicon.Icons(urls)
+        print(f"{'local icons':<14} {(time.perf_counter() - start) * 1000:8.1f} ms {len(started):6} netlocs to fetch")
+        fetch_round("first round", started, cache_dir)
+        failing = [n for n in started if not n.startswith("ok")]
+        backoffs = failures(cache_dir, failing)
+        started.clear()
+        start = time.perf_counter()
+        icons = Favicon.Icons(urls)
+        print(f"{'hot path':<14} {(time.perf_counter() - start) * 1000:8.1f} ms {len(started):6} netlocs to fetch")
+        start = time.perf_counter()
+        found = [icons.get_favion_path(u) for u, _ in urls]
+        print(f"{'icon lookups':<14} {(time.perf_counter() - start) * 1000:8.1f} ms {len([f for f in found if f]):6} icons")
+        second = fetch_round("second round", started, cache_dir)
+        # A repeated failure of a lookup
+        retried = failing[0]
+        retry_now(cache_dir, retried)
+        fetch_round("retry", [retried], cache_dir)
+        backoff = failures(cache_dir, [retried])[retried]
+    server.shutdown()
+    local = [d for d in StandIn.domains if d in local_hosts]
+    missing = [n for n, b in backoffs.items() if b is None or b <= 0]
+    ratio = backoff / backoffs[retried] if backoff and backoffs[retried] else 0
+    ok = report("second round", second == 0, f"{second} requests")
+    ok &= report("failures", bool(failing) and not missing,
+                 f"{len(failing) - len(missing)}/{len(failing)} failed lookups with a future retry")
+    ok &= report("backoff", 1.9 < ratio < 2.1, f"x{ratio:.2f} on a repeated failure of {retried}")
+    ok &= report("local hosts", not local, f"{len(local)} requests for local hosts {sorted(set(local))}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Bookmark matching: the former per-row loop (lower() per field, term and
+row) vs. the compiled Matcher on precomputed search keys
+
+Both must return the same bookmarks in the same order.
+
+Usage: python benchmarks/bench_matcher.py [bookmarks]
+"""
+import os
+import random
+import sys
+import time
+
+import fixtures
+
+os.environ.setdefault("show_favicon", "0")
+from browser_config import BOOKMARKS_MAP  # noqa: E402
+
+for k in BOOKMARKS_MAP:
+    os.environ.setdefault(k, "0")
+import chrom_bookmarks  # noqa: E402
+from records import BookmarkTable  # noqa: E402
+
+QUERIES = ("git", "github python", "car|rust", "rust&code&wiki", "école", "ÉCOLE", "straße",
+           "e", "xyz", " ", "a&", "none", "13", "level 7", "İ")
+EXTRA = ("École", "ÉCOLE", "Straße", "STRASSE", "İstanbul", "Kelvin", "naïve", "über")
+
+
+def legacy_match(search_term: str, results: list) -> list:
+    if not search_term:
+        return results
+
+    def is_in_tuple(tple: tuple, st: str) -> bool:
+        for e in tple[:3]:
+            if st.lower() in str(e).lower():
+                return True
+        return False
+
+    if '&' in search_term:
+        search_terms, use_and_logic = search_term.split('&'), True
+    elif '|' in search_term:
+        search_terms, use_and_logic = search_term.split('|'), False
+    else:
+        search_terms, use_and_logic = search_term.split(), True
+    check_func = all if use_and_logic else any
+    return [r for r in results if check_func(is_in_tuple(r, ts) for ts in search_terms)]
+
+
+def records(count: int, seed: int = 1) -> list:
+    rnd = random.Random(seed)
+    words = list(fixtures.WORDS) + list(EXTRA)
+    res = list()
+    for i in range(count):
+        name = " ".join(rnd.choice(words) for _ in range(3)) if i % 50 else None
+        path = " > ".join(rnd.choice(words).title() for _ in range(rnd.randint(0, 3))) or "Root"
+        res.append((name, f"https://{rnd.choice(words)}{i % 997}.net/{i}", path, "chrome"))
+    return res
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    rows = records(count)
+    start = time.perf_counter()
+    table = BookmarkTable.from_records(rows, "chrome")
+    table.keys = chrom_bookmarks.bookmark_keys(table)
+    print(f"{count} bookmarks, search keys built in {(time.perf_counter() - start) * 1000:.1f} ms")
+    print(f"{'query':<16} {'matches':>8} {'loop':>10} {'matcher':>10}")
+    for query in QUERIES:
+        start = time.perf_counter()
+        old = legacy_match(query, rows)
+        loop = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        new = list(chrom_bookmarks.match(query, table))
+        compiled = (time.perf_counter() - start) * 1000
+        assert old == new, f"results differ for {query!r}"
+        print(f"{query!r:<16} {len(new):8} {loop:8.1f}ms {compiled:8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
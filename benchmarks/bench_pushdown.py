@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Python side filtering of the whole urls table vs. filtering, ordering and
+LIMIT pushed down into SQLite
+
+Usage: python benchmarks/bench_pushdown.py [rows]
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import fixtures
+from sql_filter import SqlFilter, register_functions
+
+QUERIES = ("git", "github python", "rust&code", "maps|wiki", "xyz")
+SELECT = """
+    SELECT urls.url, urls.title, urls.visit_count, (urls.last_visit_time/1000000 + (strftime('%s', '1601-01-01')))
+    FROM urls
+    WHERE urls.title IS NOT NULL AND urls.title != ''"""
+
+
+def legacy(con: sqlite3.Connection, query: str) -> list:
+    rows = con.execute(SELECT).fetchall()
+
+    def is_in_tuple(tple: tuple, st: str) -> bool:
+        for e in tple[:4]:
+            if st.lower() in str(e).lower():
+                return True
+        return False
+
+    if "&" in query:
+        terms, check_func = query.split("&"), all
+    elif "|" in query:
+        terms, check_func = query.split("|"), any
+    else:
+        terms, check_func = query.split(), all
+    res = [r for r in rows if check_func(is_in_tuple(r, t) for t in terms)]
+    return sorted(res, key=lambda tup: tup[2], reverse=True)[:30]
+
+
+def pushdown(con: sqlite3.Connection, query: str) -> list:
+    if "&" in query:
+        terms, use_and_logic = query.split("&"), True
+    elif "|" in query:
+        terms, use_and_logic = query.split("|"), False
+    else:
+        terms, use_and_logic = query.split(), True
+    where, params = SqlFilter(terms, use_and_logic).clause(
+        "py_host(urls.url)", ("urls.url", "urls.title"), ("urls.visit_count",))
+    return con.execute(
+        f"{SELECT} AND {where} ORDER BY visit_count DESC, last_visit_time DESC LIMIT 30", params).fetchall()
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    with tempfile.TemporaryDirectory() as tmp:
+        db = fixtures.chromium_history(os.path.join(tmp, "History"), rows)
+        con = sqlite3.connect(db)
+        register_functions(con)
+        print(f"History with {rows} urls")
+        print(f"{'query':<16} {'python':>10} {'sql':>10} {'speedup':>8}  same result")
+        for query in QUERIES:
+            start = time.perf_counter()
+            old = legacy(con, query)
+            t_old = time.perf_counter() - start
+            start = time.perf_counter()
+            new = pushdown(con, query)
+            t_new = time.perf_counter() - start
+            same = {r[0] for r in old} == {r[0] for r in new} or len(old) == len(new) == 30
+            print(f"{query:<16} {t_old * 1000:8.0f}ms {t_new * 1000:8.0f}ms {t_old / t_new:7.1f}x  {same}")
+        con.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Memory of loaded bookmarks and history rows: plain tuples vs. the shared
+record types (BookmarkTable, HistoryEntry)
+
+Every variant runs in a fresh interpreter and reports the growth of the
+peak RSS, the tracemalloc peak and the number of live allocations.
+
+Usage: python benchmarks/bench_records.py [bookmarks] [history rows]
+"""
+import marshal
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import fixtures
+
+os.environ.setdefault("show_favicon", "0")
+from browser_config import BOOKMARKS_MAP  # noqa: E402
+
+for k in BOOKMARKS_MAP:
+    os.environ.setdefault(k, "0")
+from records import BookmarkTable, HistoryEntry  # noqa: E402
+
+HISTORY_SQL = """
+    SELECT urls.url, urls.title, urls.visit_count, urls.last_visit_time, ?
+    FROM urls"""
+
+
+def bookmark_tuples(path: str):
+    with open(path, "rb") as f:
+        return marshal.loads(f.read())
+
+
+def bookmark_table(path: str):
+    with open(path, "rb") as f:
+        return BookmarkTable.load(marshal.loads(f.read()))
+
+
+def history_tuples(path: str):
+    with sqlite3.connect(path) as c:
+        return c.execute(HISTORY_SQL, ("chrome",)).fetchall()
+
+
+def history_entries(path: str):
+    with sqlite3.connect(path) as c:
+        return [HistoryEntry(*r[:4], "chrome") for r in c.execute(HISTORY_SQL, ("chrome",))]
+
+
+VARIANTS = {
+    "bookmarks tuples": (bookmark_tuples, "bookmarks_tuples"),
+    "bookmarks table": (bookmark_table, "bookmarks_table"),
+    "history tuples": (history_tuples, "history"),
+    "history entries": (history_entries, "history"),
+}
+
+
+def run_variant(name: str, path: str) -> None:
+    func = VARIANTS[name][0]
+    rss_before = fixtures.peak_rss()
+    start = time.perf_counter()
+    data = func(path)
+    elapsed = (time.perf_counter() - start) * 1000
+    rss_mib = (fixtures.peak_rss() - rss_before) / 1024 ** 2
+    records = len(data)
+    del data
+    # second run for the allocations, tracemalloc distorts time and RSS
+    tracemalloc.start()
+    data = func(path)
+    _, peak = tracemalloc.get_traced_memory()
+    blocks = sum(s.count for s in tracemalloc.take_snapshot().statistics("filename"))
+    tracemalloc.stop()
+    print(f"{name:<18} {records:8} records {elapsed:8.1f} ms {rss_mib:8.1f} MiB RSS "
+          f"{peak / 1024 ** 2:8.1f} MiB peak {blocks:9} allocations")
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == "--variant":
+        run_variant(sys.argv[2], sys.argv[3])
+        return
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+    with tempfile.TemporaryDirectory() as tmp:
+        import chrom_bookmarks
+        bookmarks = fixtures.chromium_bookmarks(os.path.join(tmp, "Bookmarks"), count, 50)
+        records = chrom_bookmarks.get_all_urls(chrom_bookmarks.get_json_from_file(bookmarks), "chrome")
+        files = {
+            "bookmarks_tuples": records,
+            "bookmarks_table": BookmarkTable.from_records(records, "chrome").dump(),
+        }
+        for name, data in files.items():
+            with open(os.path.join(tmp, name), "wb") as f:
+                marshal.dump(data, f)
+        fixtures.chromium_history(os.path.join(tmp, "history"), rows)
+        for name, (_, file) in VARIANTS.items():
+            subprocess.run([sys.executable, os.path.abspath(__file__), "--variant",
+                            name, os.path.join(tmp, file)], check=True)
+
+
+if __name__ == "__main__":
+    main()
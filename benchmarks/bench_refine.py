@@ -0,0 +1,57 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+History search while a query is typed: every keystroke searched from
+scratch vs. refined from the cached matches of the previous keystrokes
+
+Both must return the same entries.
+
+Usage: python benchmarks/bench_refine.py [rows] 2>/dev/null
+"""
+import os
+import sys
+import tempfile
+import time
+
+import fixtures
+from history_mirror import HistoryMirror
+from refine_cache import RefinementCache
+from sql_filter import SqlFilter
+
+TYPED = ("github python", "wiki 42", "music99.com")
+
+
+def keystrokes(query: str) -> list:
+    return [query[:i] for i in range(1, len(query) + 1) if not query[:i].endswith(" ")]
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    with tempfile.TemporaryDirectory() as tmp:
+        db = fixtures.chromium_history(os.path.join(tmp, "History"), rows)
+        mirror = HistoryMirror(os.path.join(tmp, "history_mirror.db"))
+        mirror.sync([(db, "chrome")])
+        mirror.build_index()
+        refinements = RefinementCache(os.path.join(tmp, "refinements.db"))
+        print(f"History mirror with {rows} rows and trigram index")
+        print(f"{'typed':<16} {'keys':>5} {'scratch':>10} {'refined':>10}")
+        for query in TYPED:
+            t_scratch = t_refined = 0
+            for q in keystrokes(query):
+                sql_filter = SqlFilter(q.split())
+                start = time.perf_counter()
+                old = mirror.query(["chrome"], sql_filter, limit=30)
+                t_scratch += time.perf_counter() - start
+                start = time.perf_counter()
+                new = mirror.query(["chrome"], sql_filter, limit=30, refinements=refinements)
+                t_refined += time.perf_counter() - start
+                assert old == new, f"results differ for {q!r}"
+            print(f"{query!r:<16} {len(keystrokes(query)):5} {t_scratch * 1000:8.1f}ms {t_refined * 1000:8.1f}ms")
+        hits, misses = refinements.stats("history")
+        print(f"Refinement cache hit rate: {hits}/{hits + misses}")
+        refinements.close()
+        mirror.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Rows and latency of the former urls x visits queries vs. the one row per
+URL queries used by chrom_history.sql()
+
+Usage: python benchmarks/bench_rows.py [rows] [visits per url]
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import fixtures
+
+CHROMIUM = {
+    "join + DISTINCT": """
+        SELECT DISTINCT urls.url, urls.title, urls.visit_count, (urls.last_visit_time/1000000 + (strftime('%s', '1601-01-01')))
+        FROM urls, visits
+        WHERE urls.id = visits.url AND urls.title IS NOT NULL AND urls.title != ''
+        ORDER BY last_visit_time DESC""",
+    "EXISTS": """
+        SELECT urls.url, urls.title, urls.visit_count, (urls.last_visit_time/1000000 + (strftime('%s', '1601-01-01')))
+        FROM urls
+        WHERE EXISTS (SELECT 1 FROM visits WHERE visits.url = urls.id) AND urls.title IS NOT NULL AND urls.title != ''
+        ORDER BY last_visit_time DESC""",
+}
+
+SAFARI = {
+    "join per visit": """
+        SELECT history_items.url, history_visits.title, history_items.visit_count, (history_visits.visit_time + 978307200)
+        FROM history_items INNER JOIN history_visits ON history_visits.history_item = history_items.id
+        WHERE history_items.url IS NOT NULL AND history_visits.title IS NOT NULL AND history_items.url != ''
+        ORDER BY visit_time DESC""",
+    "GROUP BY MAX": """
+        SELECT history_items.url, history_visits.title, history_items.visit_count, (MAX(history_visits.visit_time) + 978307200) AS last_visit
+        FROM history_items INNER JOIN history_visits ON history_visits.history_item = history_items.id
+        WHERE history_items.url IS NOT NULL AND history_visits.title IS NOT NULL AND history_items.url != ''
+        GROUP BY history_items.id
+        ORDER BY last_visit DESC""",
+}
+
+
+def run(db: str, statements: dict) -> None:
+    con = sqlite3.connect(db)
+    for name, statement in statements.items():
+        start = time.perf_counter()
+        rows = con.execute(statement).fetchall()
+        print(f"  {name:<16} {len(rows):>9} rows {(time.perf_counter() - start) * 1000:9.1f} ms")
+    con.close()
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    visits = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"Chromium, {rows} urls")
+        run(fixtures.chromium_history(os.path.join(tmp, "History"), rows, visits), CHROMIUM)
+        print(f"Safari, {rows} items with {visits} visits each")
+        run(fixtures.safari_history(os.path.join(tmp, "History.db"), rows, visits), SAFARI)
+
+
+if __name__ == "__main__":
+    main()
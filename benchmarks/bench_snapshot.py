@@ -0,0 +1,56 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Compare the legacy /tmp copy of a History file with the snapshot strategies
+
+Usage: python benchmarks/bench_snapshot.py [rows]
+"""
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+
+import fixtures
+from snapshot import open_snapshot
+
+QUERY = "SELECT COUNT(*), MAX(last_visit_time) FROM urls"
+
+
+def legacy_copy(db: str) -> None:
+    history_db = f"/tmp/{uuid.uuid1()}"
+    shutil.copy2(db, history_db)
+    with sqlite3.connect(history_db) as c:
+        c.execute(QUERY).fetchall()
+    os.remove(history_db)
+
+
+def snapshot(db: str, strategies: tuple) -> None:
+    with open_snapshot(db, strategies) as c:
+        c.execute(QUERY).fetchall()
+
+
+def measure(name: str, func, *args, runs: int = 5) -> None:
+    io_before = fixtures.io_bytes()
+    start = time.perf_counter()
+    for _ in range(runs):
+        func(*args)
+    elapsed = (time.perf_counter() - start) / runs * 1000
+    io = (fixtures.io_bytes() - io_before) // runs if io_before >= 0 else -1
+    print(f"{name:<12} {elapsed:9.2f} ms {io / 1024:12.0f} KiB I/O")
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    with tempfile.TemporaryDirectory() as tmp:
+        db = fixtures.chromium_history(os.path.join(tmp, "History"), rows)
+        print(f"History with {rows} urls, {os.path.getsize(db) / 1024 ** 2:.1f} MiB")
+        measure("legacy copy", legacy_copy, db)
+        for strategy in ("ro", "immutable", "copy"):
+            measure(strategy, snapshot, db, (strategy,))
+
+
+if __name__ == "__main__":
+    main()
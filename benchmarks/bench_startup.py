@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Startup budget of the script filters
+
+Reports the per-module import costs (as collected by -X importtime) and
+the cold-run wall time of chrom_history.py and chrom_bookmarks.py, each
+started as a fresh interpreter like Alfred does.
+
+Usage: python benchmarks/bench_startup.py [--runs N] [--top N] [--budget-ms MS]
+Exits with 1 if the median cold run of a script exceeds the budget.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import fixtures
+
+SCRIPTS = (("chrom_history.py", "git"), ("chrom_bookmarks.py", "git"))
+
+
+def import_times(script: str, query: str, env: dict) -> list:
+    """
+    Import costs of a script run
+
+    Returns:
+        list: tuples (cumulative us, self us, module) sorted by cumulative time
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", script, query],
+        cwd=fixtures.SRC_DIR, env=env, capture_output=True, text=True)
+    res = list()
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:"):].split("|")
+        res.append((int(cumulative_us), int(self_us), module.rstrip()))
+    return sorted(res, reverse=True)
+
+
+def cold_runs(script: str, query: str, env: dict, runs: int) -> list:
+    """
+    Wall times of complete script runs in ms
+    """
+    times = list()
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, script, query], cwd=fixtures.SRC_DIR,
+                       env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--budget-ms", type=float, default=None)
+    args = parser.parse_args()
+    over_budget = False
+    with tempfile.TemporaryDirectory() as tmp:
+        home = fixtures.workflow_home(os.path.join(tmp, "home"))
+        env = fixtures.workflow_env(home, os.path.join(tmp, "cache"))
+        os.makedirs(env["alfred_workflow_cache"])
+        # interpreter without any workflow module as reference
+        baseline = statistics.median(cold_runs("-c", "pass", env, args.runs))
+        print(f"python -c pass: {baseline:.1f} ms (median)\n")
+        for script, query in SCRIPTS:
+            cold_runs(script, query, env, 1)  # warm up mirror and pyc files
+            times = cold_runs(script, query, env, args.runs)
+            median = statistics.median(times)
+            print(f"{script} '{query}': median {median:.1f} ms, min {min(times):.1f} ms")
+            print(f"  {'cumulative':>12} {'self':>8}  module")
+            for cumulative, self_us, module in import_times(script, query, env)[:args.top]:
+                print(f"  {cumulative / 1000:10.1f}ms {self_us / 1000:6.1f}ms  {module}")
+            print()
+            if args.budget_ms is not None and median > args.budget_ms:
+                print(f"  !! {script} exceeds budget of {args.budget_ms} ms")
+                over_budget = True
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == "__main__":
+    main()
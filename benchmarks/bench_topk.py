@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Top entries of several History files ordered by last visit (no LIMIT per
+file is possible then): all rows fetched, deduplicated and sorted vs. rows
+streamed through the dedupe into a bounded top-K selection
+
+All files hold the same urls, as if every browser visited the same pages.
+Reports time and tracemalloc peak. Both must return the same ranking, the
+streaming peak must stay within the measured size of the dedupe dict of
+the distinct matches and clearly below the peak of fetching all rows.
+
+Usage: python benchmarks/bench_topk.py [rows per file] [files] 2>/dev/null
+Exits with 1 if a streaming peak exceeds its budget.
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import fixtures
+
+# chrom_history reads its settings on import, the History files are passed explicitly
+os.environ.update(fixtures.workflow_env(tempfile.gettempdir(), tempfile.gettempdir()))
+import chrom_history  # noqa: E402
+from Alfred3 import Tools  # noqa: E402
+
+QUERIES = ("", "git", "github python")
+# Allowed streaming peak: per-entry size of the dedupe dict times distinct
+# matches plus slack, and this share of the fetch-all peak plus slack at most
+ENTRY_SLACK = 1.25
+FIXED_SLACK = 1024 * 1024
+MAX_SHARE = 0.6
+
+
+def fetch_all(pairs: list, sql_filter) -> list:
+    matches = [e for pair in pairs for e in list(chrom_history.sql([pair], sql_filter))]
+    results = Tools.sortListTuple(chrom_history.removeDuplicates(matches), 3)
+    return results[:chrom_history.RESULT_LIMIT]
+
+
+def streaming(pairs: list, sql_filter) -> list:
+    entries = (e for pair in pairs for e in chrom_history.sql([pair], sql_filter))
+    return chrom_history.top_entries(entries, chrom_history.RESULT_LIMIT)
+
+
+def measure(func, *args) -> tuple:
+    tracemalloc.start()
+    start = time.perf_counter()
+    res = func(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return res, elapsed, peak
+
+
+def dedupe_dict(pairs: list, sql_filter) -> int:
+    return len(chrom_history.removeDuplicates(chrom_history.sql(pairs, sql_filter)))
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    files = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    chrom_history.sort_recent = True
+    with tempfile.TemporaryDirectory() as tmp:
+        pairs = list()
+        for i in range(files):
+            os.mkdir(os.path.join(tmp, str(i)))
+            pairs.append((fixtures.chromium_history(os.path.join(tmp, str(i), "History"), rows), f"b{i}"))
+        # Size of one dedupe dict entry with its HistoryEntry, all urls of a file are distinct
+        distinct, _, m_dict = measure(dedupe_dict, pairs[:1], chrom_history.get_sql_filter(""))
+        per_entry = m_dict / distinct
+        print(f"{files} History files with the same {rows} urls each, ordered by last visit")
+        print(f"dedupe dict: {per_entry:.0f} bytes per distinct url")
+        print(f"{'query':<16} {'rows':>8} {'distinct':>8} {'fetch all':>18} {'streaming':>18} {'budget':>9}")
+        failed = False
+        for query in QUERIES:
+            sql_filter = chrom_history.get_sql_filter(query)
+            matches = sum(1 for pair in pairs for _ in chrom_history.sql([pair], sql_filter))
+            distinct = len({e.url for e in chrom_history.sql(pairs[:1], sql_filter)})
+            old, t_old, m_old = measure(fetch_all, pairs, sql_filter)
+            new, t_new, m_new = measure(streaming, pairs, sql_filter)
+            assert [e.last_visit for e in old] == [e.last_visit for e in new], f"ranking differs for {query!r}"
+            # Bounded by the distinct matches, not by the rows of the History files
+            budget = FIXED_SLACK + ENTRY_SLACK * per_entry * distinct
+            ok = m_new <= budget and m_new <= MAX_SHARE * m_old + FIXED_SLACK
+            failed |= not ok
+            print(f"{query!r:<16} {matches:8} {distinct:8} {t_old * 1000:7.0f}ms {m_old / 2 ** 20:6.1f}MiB "
+                  f"{t_new * 1000:7.0f}ms {m_new / 2 ** 20:6.1f}MiB {budget / 2 ** 20:6.1f}MiB"
+                  f"{'' if ok else '  FAIL'}")
+        sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Substring search in the history mirror: scan of all rows vs. lookup in the
+trigram index with verification of the candidates
+
+Both must return the same rows.
+
+Usage: python benchmarks/bench_trigram.py [rows] 2>/dev/null
+"""
+import os
+import sys
+import tempfile
+import time
+
+import fixtures
+from history_mirror import HistoryMirror
+from sql_filter import SqlFilter
+
+QUERIES = ("github", "xyz", "git 4711", "rust&code", "maps|wiki", "music99.com", "/42", "weather 13", "gi")
+
+
+def search(mirror: HistoryMirror, query: str) -> list:
+    if "&" in query:
+        terms, use_and_logic = query.split("&"), True
+    elif "|" in query:
+        terms, use_and_logic = query.split("|"), False
+    else:
+        terms, use_and_logic = query.split(), True
+    return mirror.query(["chrome"], SqlFilter(terms, use_and_logic))
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    with tempfile.TemporaryDirectory() as tmp:
+        db = fixtures.chromium_history(os.path.join(tmp, "History"), rows)
+        mirror = HistoryMirror(os.path.join(tmp, "history_mirror.db"))
+        mirror.sync([(db, "chrome")])
+        results = dict()
+        timings = dict()
+        for query in QUERIES:
+            start = time.perf_counter()
+            results[query] = search(mirror, query)
+            timings[query] = time.perf_counter() - start
+        start = time.perf_counter()
+        mirror.build_index()
+        print(f"History mirror with {rows} rows, trigram index built in {time.perf_counter() - start:.1f} s, "
+              f"{os.path.getsize(mirror.trigram_path) / 2 ** 20:.1f} MiB")
+        print(f"{'query':<14} {'matches':>8} {'scan':>10} {'index':>10}")
+        for query in QUERIES:
+            start = time.perf_counter()
+            res = search(mirror, query)
+            t_index = time.perf_counter() - start
+            assert sorted(res) == sorted(results[query]), f"results differ for {query!r}"
+            print(f"{query!r:<14} {len(res):8} {timings[query] * 1000:8.1f}ms {t_index * 1000:8.1f}ms")
+        mirror.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Synthetic browser data for the benchmarks
+"""
+import json
+import os
+import plistlib
+import random
+import sqlite3
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+WORDS = ("git github python alfred car bike rental news mail docs rust sqlite "
+         "weather maps video music shop travel code review wiki blog").split()
+
+
+def chromium_history(path: str, rows: int, visits_per_url: int = 3, seed: int = 1) -> str:
+    """
+    Create a Chromium History database with the relevant tables
+
+    Args:
+        path (str): Path of the database to create
+        rows (int): number of urls
+        visits_per_url (int, optional): max visits per url, visit_count is random up to it. Defaults to 3.
+        seed (int, optional): random seed. Defaults to 1.
+
+    Returns:
+        str: path of the database
+    """
+    rnd = random.Random(seed)
+    os.path.exists(path) and os.remove(path)
+    c = sqlite3.connect(path)
+    c.executescript("""
+        CREATE TABLE urls(id INTEGER PRIMARY KEY AUTOINCREMENT, url LONGVARCHAR, title LONGVARCHAR,
+            visit_count INTEGER DEFAULT 0 NOT NULL, typed_count INTEGER DEFAULT 0 NOT NULL,
+            last_visit_time INTEGER NOT NULL, hidden INTEGER DEFAULT 0 NOT NULL);
+        CREATE INDEX urls_url_index ON urls (url);
+        CREATE TABLE visits(id INTEGER PRIMARY KEY AUTOINCREMENT, url INTEGER NOT NULL, visit_time INTEGER NOT NULL);
+        CREATE INDEX visits_url_index ON visits (url);
+        CREATE INDEX visits_time_index ON visits (visit_time);
+    """)
+
+    def urls():
+        for i in range(1, rows + 1):
+            a, b = rnd.sample(WORDS, 2)
+            yield (i, f"https://{a}{i % 997}.com/{b}/{i}", f"{a.title()} {b} {i}",
+                   rnd.randint(1, visits_per_url), 13300000000000000 + rnd.randint(0, 10 ** 13))
+
+    c.executemany(
+        "INSERT INTO urls(id, url, title, visit_count, last_visit_time) VALUES (?, ?, ?, ?, ?)", urls())
+    for k in range(visits_per_url):
+        c.execute("""
+            INSERT INTO visits(url, visit_time)
+            SELECT id, last_visit_time - ? FROM urls WHERE visit_count > ?""", (k * 1000000, k))
+    c.commit()
+    c.close()
+    return path
+
+
+def safari_history(path: str, rows: int, visits_per_item: int = 3, seed: int = 1) -> str:
+    """
+    Create a Safari History.db with the relevant tables
+
+    Args:
+        path (str): Path of the database to create
+        rows (int): number of history items
+        visits_per_item (int, optional): visits per item. Defaults to 3.
+        seed (int, optional): random seed. Defaults to 1.
+
+    Returns:
+        str: path of the database
+    """
+    rnd = random.Random(seed)
+    os.path.exists(path) and os.remove(path)
+    c = sqlite3.connect(path)
+    c.executescript("""
+        PRAGMA journal_mode=WAL;
+        CREATE TABLE history_items (id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT NOT NULL UNIQUE,
+            domain_expansion TEXT NULL, visit_count INTEGER NOT NULL);
+        CREATE TABLE history_visits (id INTEGER PRIMARY KEY AUTOINCREMENT,
+            history_item INTEGER NOT NULL REFERENCES history_items(id), visit_time REAL NOT NULL, title TEXT NULL);
+        CREATE INDEX history_visits__item ON history_visits (history_item);
+        CREATE INDEX history_visits__time ON history_visits (visit_time);
+    """)
+
+    def items():
+        for i in range(1, rows + 1):
+            a, b = rnd.sample(WORDS, 2)
+            yield (i, f"https://{a}{i % 997}.org/{b}/{i}", None, visits_per_item)
+
+    def visits():
+        for i in range(1, rows + 1):
+            for k in range(visits_per_item):
+                yield (i, 700000000.0 + i * 10 + k, f"Item {i} visit {k}")
+
+    c.executemany("INSERT INTO history_items VALUES (?, ?, ?, ?)", items())
+    c.executemany(
+        "INSERT INTO history_visits(history_item, visit_time, title) VALUES (?, ?, ?)", visits())
+    c.commit()
+    c.close()
+    return path
+
+
+def chromium_favicons(path: str, pages: list, widths: tuple = (16, 32)) -> str:
+    """
+    Create a Chromium Favicons database with one icon per page
+
+    Args:
+        path (str): Path of the database to create
+        pages (list): page urls
+        widths (tuple, optional): bitmap sizes stored per icon. Defaults to (16, 32).
+
+    Returns:
+        str: path of the database
+    """
+    os.path.exists(path) and os.remove(path)
+    c = sqlite3.connect(path)
+    c.executescript("""
+        CREATE TABLE favicons(id INTEGER PRIMARY KEY, url LONGVARCHAR NOT NULL, icon_type INTEGER DEFAULT 1);
+        CREATE TABLE favicon_bitmaps(id INTEGER PRIMARY KEY, icon_id INTEGER NOT NULL,
+            last_updated INTEGER DEFAULT 0, image_data BLOB, width INTEGER DEFAULT 0,
+            height INTEGER DEFAULT 0, last_requested INTEGER NOT NULL DEFAULT 0);
+        CREATE TABLE icon_mapping(id INTEGER PRIMARY KEY, page_url LONGVARCHAR NOT NULL,
+            icon_id INTEGER, page_url_type INTEGER DEFAULT 0);
+        CREATE INDEX icon_mapping_page_url_idx ON icon_mapping(page_url);
+    """)
+    for icon_id, page in enumerate(pages, 1):
+        c.execute("INSERT INTO favicons VALUES (?, ?, 1)", (icon_id, f"{page}/favicon.ico"))
+        c.execute("INSERT INTO icon_mapping (page_url, icon_id) VALUES (?, ?)", (page, icon_id))
+        c.executemany(
+            "INSERT INTO favicon_bitmaps (icon_id, image_data, width, height) VALUES (?, ?, ?, ?)",
+            [(icon_id, b"\x89PNG" + bytes(w), w, w) for w in widths])
+    c.commit()
+    c.close()
+    return path
+
+
+def chromium_bookmarks(path: str, count: int, depth: int = 3, seed: int = 1) -> str:
+    """
+    Create a Chromium Bookmarks file with count bookmarks spread over a
+    folder chain of given depth
+
+    Args:
+        path (str): Path of the file to create
+        count (int): number of bookmarks
+        depth (int, optional): folder nesting level. Defaults to 3.
+        seed (int, optional): random seed. Defaults to 1.
+
+    Returns:
+        str: path of the file
+    """
+    rnd = random.Random(seed)
+    per_level = max(1, count // depth)
+    bar = {"type": "folder", "name": "Bookmarks Bar", "children": []}
+    folder = bar
+    written = 0
+    for level in range(depth):
+        n = per_level if level < depth - 1 else count - written
+        folder["children"].extend(
+            {"type": "url", "name": f"{rnd.choice(WORDS)} {written + i}",
+             "url": f"https://{rnd.choice(WORDS)}{(written + i) % 997}.net/{written + i}"}
+            for i in range(n))
+        written += n
+        if level < depth - 1:
+            sub = {"type": "folder", "name": f"Level {level + 1}", "children": []}
+            folder["children"].append(sub)
+            folder = sub
+    roots = {"bookmark_bar": bar,
+             "other": {"type": "folder", "name": "Other Bookmarks", "children": []}}
+    with open(path, "w") as f:
+        json.dump({"checksum": f"{seed}-{count}-{depth}", "roots": roots, "version": 1}, f)
+    return path
+
+
+def safari_bookmarks(path: str, count: int, depth: int = 3, seed: int = 1) -> str:
+    """
+    Create a Safari Bookmarks.plist with count bookmarks spread over a
+    folder chain of given depth
+
+    Args:
+        path (str): Path of the file to create
+        count (int): number of bookmarks
+        depth (int, optional): folder nesting level. Defaults to 3.
+        seed (int, optional): random seed. Defaults to 1.
+
+    Returns:
+        str: path of the file
+    """
+    rnd = random.Random(seed)
+    per_level = max(1, count // depth)
+    root = {"Title": "", "Children": []}
+    folder = root
+    written = 0
+    for level in range(depth):
+        n = per_level if level < depth - 1 else count - written
+        folder["Children"].extend(
+            {"URLString": f"https://{rnd.choice(WORDS)}{(written + i) % 997}.org/{written + i}",
+             "URIDictionary": {"title": f"{rnd.choice(WORDS)} {written + i}"}}
+            for i in range(n))
+        written += n
+        if level < depth - 1:
+            sub = {"Title": f"Level {level + 1}", "Children": []}
+            folder["Children"].append(sub)
+            folder = sub
+    with open(path, "wb") as f:
+        plistlib.dump(root, f, fmt=plistlib.FMT_BINARY)
+    return path
+
+
+def workflow_env(home: str, cache_dir: str, browsers: tuple = ("chrome",)) -> dict:
+    """
+    Environment for running the script filters like Alfred does
+
+    Args:
+        home (str): fake home directory containing the browser files
+        cache_dir (str): workflow cache/data directory
+        browsers (tuple, optional): enabled browsers. Defaults to ("chrome",).
+
+    Returns:
+        dict: environment variables
+    """
+    from browser_config import HISTORY_MAP
+    env = dict(os.environ)
+    env.update({k: "1" if k in browsers else "0" for k in HISTORY_MAP})
+    env.update({
+        "HOME": home,
+        "alfred_workflow_cache": cache_dir,
+        "alfred_workflow_data": cache_dir,
+        "show_favicon": "0",
+        "sort_recent": "0",
+        "ignored_domains": "",
+        "date_format": "%d.%m.%Y",
+        "search_operator_default": "AND",
+        "search_daemon": "0",
+    })
+    return env
+
+
+def workflow_home(home: str, rows: int = 20000, bookmarks: int = 2000) -> str:
+    """
+    Fake home directory with Chrome History and Bookmarks
+
+    Args:
+        home (str): directory to create the files in
+        rows (int, optional): history urls. Defaults to 20000.
+        bookmarks (int, optional): number of bookmarks. Defaults to 2000.
+
+    Returns:
+        str: home directory
+    """
+    from browser_config import BOOKMARKS_MAP, HISTORY_MAP
+    history = os.path.join(home, HISTORY_MAP["chrome"])
+    os.makedirs(os.path.dirname(history), exist_ok=True)
+    chromium_history(history, rows)
+    chromium_bookmarks(os.path.join(home, BOOKMARKS_MAP["chrome"]), bookmarks)
+    return home
+
+
+def io_bytes() -> int:
+    """
+    Bytes read and written by this process so far (Linux only)
+
+    Returns:
+        int: rchar + wchar from /proc/self/io or -1 if not available
+    """
+    try:
+        with open("/proc/self/io") as f:
+            stats = dict(line.split(": ") for line in f.read().splitlines())
+        return int(stats["rchar"]) + int(stats["wchar"])
+    except (OSError, KeyError):
+        return -1
+
+
+def peak_rss() -> int:
+    """
+    Peak resident set size of this process
+
+    Returns:
+        int: bytes, VmHWM on Linux (ru_maxrss survives exec there), ru_maxrss otherwise
+    """
+    try:
+        with open("/proc/self/status") as f:
+            stats = dict(line.split(":", 1) for line in f.read().splitlines())
+        return int(stats["VmHWM"].split()[0]) * 1024
+    except (OSError, KeyError):
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # bytes on macOS, KiB elsewhere
+        return rss if sys.platform == "darwin" else rss * 1024
@@ -4,8 +4,6 @@ import json
 import os
 import sys
 import time
-from plistlib import dump, load
-from urllib.parse import urlparse
 
 """
 Alfred Script Filter generator class
@@ -27,6 +25,8 @@ class Items(object):
         self.item = {}
         self.items = []
         self.mods = {}
+        self.cache = None
+        self.rerun = None
 
     def getItemsLengths(self) -> int:
         """
@@ -75,6 +75,31 @@ class Items(object):
         for key, value in kwargs.items():
             self.setKv(key, value)
 
+    def setCache(self, seconds: int, loosereload: bool = False) -> None:
+        """
+        Let Alfred cache the Script Filter output (Alfred 5.5+)
+
+        Args:
+
+            seconds (int): Time to live, limited to the 5-86400 seconds Alfred accepts
+            loosereload (bool, optional): Show cached output and run the script
+                in background to replace it. Defaults to False.
+        """
+        self.cache = {
+            "seconds": min(max(int(seconds), 5), 86400),
+            "loosereload": loosereload
+        }
+
+    def setRerun(self, seconds: float) -> None:
+        """
+        Let Alfred rerun the Script Filter while the query does not change
+
+        Args:
+
+            seconds (float): Interval, limited to the 0.1-5 seconds Alfred accepts
+        """
+        self.rerun = min(max(float(seconds), 0.1), 5.0)
+
     def getItem(self, d_type: str = "") -> str:
         """
         Get current item definition for validation
@@ -112,11 +137,16 @@ class Items(object):
         if response_type not in valid_keys:
             raise ValueError(f"Type must be in: {valid_keys}")
         the_items = dict()
+        if self.cache is not None:
+            the_items.update({"cache": self.cache})
+        if self.rerun is not None:
+            the_items.update({"rerun": self.rerun})
         the_items.update({"items": self.items})
         if response_type == "dict":
             return the_items
         elif response_type == "json":
-            return json.dumps(the_items, default=str, indent=4)
+            # Compact, Alfred does not need indentation
+            return json.dumps(the_items, default=str, separators=(",", ":"))
 
     def setIcon(self, m_path: str, m_type: str = "") -> None:
         """
@@ -219,7 +249,9 @@ class Items(object):
             response_type (str, optional): json or dict as output format. Defaults to 'json'.
         """
         output = self.getItems(response_type=response_type)
-        sys.stdout.write(output)
+        # Encoded output in a single write to the binary buffer
+        sys.stdout.buffer.write(output.encode("utf-8"))
+        sys.stdout.buffer.flush()
 
 
 class Tools(object):
@@ -289,6 +321,25 @@ class Tools(object):
         except AttributeError as e:
             sys.exit(f'ERROR: Alfred Environment "{var}" Variable not found!')
 
+    @staticmethod
+    def getEnvInt(var: str, default: int = 0) -> int:
+        """
+        Reads integer env variable provided as text
+
+        Args:
+
+            var (str): Name of the env variable
+            default (int, optional): Default if not found or not a number. Defaults to 0.
+
+        Returns:
+
+            int: value of the env variable
+        """
+        try:
+            return int(os.getenv(var).strip())
+        except (AttributeError, ValueError):
+            return default
+
     @staticmethod
     def getArgv(i: int, default=str()) -> str:
         """
@@ -494,6 +545,7 @@ class Tools(object):
             str: URL string
 
         """
+        from urllib.parse import urlparse
         url = Tools.formatUrl(url)
         p = urlparse(url=url)
         return f"{p.scheme}://{p.netloc}"
@@ -511,6 +563,7 @@ class Plist:
     """
 
     def __init__(self):
+        from plistlib import load
         # Read info.plist into a standard Python dictionary
         with open("info.plist", "rb") as fp:
             self.info = load(fp)
@@ -569,6 +622,7 @@ class Plist:
         """
         Save changes to Plist
         """
+        from plistlib import dump
         with open("info.plist", "wb") as fp:
             dump(self.info, fp)
 
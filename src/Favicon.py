@@ -1,15 +1,233 @@
-import multiprocessing
 import os
+import sqlite3
+import sys
 import time
-import urllib.request
 from urllib.parse import urlparse
 
 from Alfred3 import Tools
+from browser_config import HISTORY_MAP
+from detached import spawn_detached
+from file_lock import FileLock, atomic_write
+from snapshot import open_snapshot
+
+FAVICON_URL = "https://www.google.com/s2/favicons?domain={netloc}&sz=128"
+# Manifest of the favicon cache in wf cache directory
+MANIFEST_FILE = "favicons.db"
+# Days until a cached favicon gets downloaded again
+MAX_AGE_DAYS = 60
+# Max. parallel downloads of the background fetcher
+MAX_WORKERS = 8
+# Seconds until a single download is given up
+REQUEST_TIMEOUT = 3
+# Seconds until the background fetcher gives up the remaining downloads
+TOTAL_TIMEOUT = 15
+# Seconds until a failed lookup is retried, doubled on every further failure
+RETRY_BACKOFF = 60 * 60
+# Max. seconds until a failed lookup is retried
+FAILURE_TTL = 7 * 24 * 60 * 60
+# Snapshot strategies for the browsers' Favicons databases, a copy would
+# take longer than the download
+LOCAL_STRATEGIES = ("ro", "immutable")
+# Hosts which are never known to the favicon service
+LOCAL_SUFFIXES = (".local", ".localhost", ".internal", ".intranet", ".lan", ".home.arpa", ".corp")
+
+
+def is_public_host(netloc: str) -> bool:
+    """
+    Check if a netloc can be looked up at the favicon service at all,
+    rules out localhost, intranet hosts without dot and ip addresses
+
+    Args:
+        netloc (str): Network location e.g. http://www.google.com = www.google.com
+
+    Returns:
+        bool: True if a lookup makes sense
+    """
+    host = netloc.rpartition("@")[2]
+    if host.startswith("["):
+        # IPv6 address
+        return False
+    host = host.partition(":")[0].lower().rstrip(".")
+    if "." not in host or host.endswith(LOCAL_SUFFIXES):
+        return False
+    return not host.replace(".", "").isdigit()
+
+
+class FaviconManifest(object):
+    """
+    Index of the favicon cache: icon file, size, fetch time and lookup
+    status per netloc. Failed lookups are retried with exponential backoff.
+
+    Args:
+
+        object (obj): -
+
+    """
+
+    def __init__(self, cache_dir: str) -> None:
+        """
+        Open (or create) the manifest
+
+        Args:
+            cache_dir (str): wf cache directory
+        """
+        self.con = sqlite3.connect(os.path.join(cache_dir, MANIFEST_FILE), timeout=5)
+        with self.con:
+            self.con.execute("""
+                CREATE TABLE IF NOT EXISTS icons (
+                    netloc TEXT PRIMARY KEY,
+                    file TEXT,
+                    size INTEGER,
+                    fetched REAL,
+                    status TEXT,
+                    failures INTEGER,
+                    retry_after REAL
+                )""")
+
+    def close(self) -> None:
+        self.con.close()
+
+    def load(self, netlocs: list) -> dict:
+        """
+        Manifest entries of given netlocs, read with a single query
+
+        Args:
+            netlocs (list): Network locations
+
+        Returns:
+            dict: netloc and tuple (file, size, fetched, status, retry_after)
+        """
+        entries = dict()
+        # Stay below SQLite's limit of host parameters
+        for i in range(0, len(netlocs), 500):
+            chunk = netlocs[i:i + 500]
+            entries.update((r[0], r[1:]) for r in self.con.execute(
+                f"SELECT netloc, file, size, fetched, status, retry_after FROM icons WHERE netloc IN ({','.join('?' * len(chunk))})",
+                chunk))
+        return entries
+
+    def update(self, results: dict) -> None:
+        """
+        Record lookup results. Failures extend the backoff but keep a
+        previously fetched icon, successes reset it.
+
+        Args:
+            results (dict): netloc and size of the cached icon, 0 if lookup failed
+        """
+        now = time.time()
+        with self.con:
+            for netloc, size in results.items():
+                if size:
+                    self.con.execute(
+                        "INSERT OR REPLACE INTO icons VALUES (?, ?, ?, ?, 'ok', 0, 0)",
+                        (netloc, f"{netloc}.png", size, now))
+                    continue
+                row = self.con.execute(
+                    "SELECT file, size, fetched, failures FROM icons WHERE netloc = ?", (netloc,)).fetchone()
+                file, icon_size, fetched, failures = row if row else (None, 0, 0, 0)
+                failures += 1
+                backoff = min(RETRY_BACKOFF * 2 ** (failures - 1), FAILURE_TTL)
+                self.con.execute(
+                    "INSERT OR REPLACE INTO icons VALUES (?, ?, ?, ?, 'failed', ?, ?)",
+                    (netloc, file, icon_size, fetched, failures, now + backoff))
+
+
+def favicon_dbs() -> list:
+    """
+    Favicons databases of the enabled Chromium based browsers, located
+    next to their History file
+
+    Returns:
+        list: paths of existing Favicons databases
+    """
+    user_dir = os.path.expanduser("~")
+    dbs = list()
+    for browser, history in HISTORY_MAP.items():
+        if browser == "safari" or os.getenv(browser, "0").lower() not in ("1", "true"):
+            continue
+        db = os.path.join(user_dir, os.path.dirname(history), "Favicons")
+        if os.path.isfile(db):
+            dbs.append(db)
+    return dbs
+
+
+def read_local_favicons(pages: dict) -> dict:
+    """
+    Read icons of the given pages from the browsers' Favicons databases,
+    one query per browser. The largest bitmap of a page wins.
+
+    Args:
+        pages (dict): netloc and list of page urls
+
+    Returns:
+        dict: netloc and PNG data
+    """
+    netloc_of = {u: n for n, urls in pages.items() for u in urls}
+    icons = dict()
+    for db in favicon_dbs():
+        urls = [u for u in netloc_of if netloc_of[u] not in icons]
+        if not urls:
+            break
+        found = dict()
+        try:
+            with open_snapshot(db, LOCAL_STRATEGIES) as c:
+                for i in range(0, len(urls), 500):
+                    chunk = urls[i:i + 500]
+                    for page_url, data in c.execute(f"""
+                            SELECT icon_mapping.page_url, favicon_bitmaps.image_data
+                            FROM icon_mapping
+                                INNER JOIN favicon_bitmaps
+                                ON favicon_bitmaps.icon_id = icon_mapping.icon_id
+                            WHERE icon_mapping.page_url IN ({','.join('?' * len(chunk))})
+                                AND length(favicon_bitmaps.image_data) > 0
+                            ORDER BY favicon_bitmaps.width""", chunk):
+                        found[netloc_of[page_url]] = data
+        except sqlite3.Error as e:
+            Tools.log(f"Favicons of {db} not readable: {e}")
+        icons.update(found)
+        Tools.log(f"{len(found)} favicon(s) found in {db}")
+    return icons
+
+
+def store_icon(cache_dir: str, netloc: str, data: bytes) -> int:
+    """
+    Write icon into wf cache directory, readers see either the old or
+    the complete new icon
+
+    Args:
+        cache_dir (str): wf cache directory
+        netloc (str): Network location
+        data (bytes): PNG data
+
+    Returns:
+        int: size of the icon
+    """
+    atomic_write(os.path.join(cache_dir, f"{netloc}.png"), data)
+    return len(data)
+
+
+def needs_fetch(entry: tuple, now: float) -> bool:
+    """
+    Check if the favicon of a manifest entry has to be (re-)fetched
+
+    Args:
+        entry (tuple): manifest entry as returned by FaviconManifest.load() or None
+        now (float): current time
+
+    Returns:
+        bool: True if icon is missing or expired and no backoff is pending
+    """
+    if entry is None:
+        return True
+    _, _, fetched, status, retry_after = entry
+    if status == "failed":
+        return retry_after <= now
+    return fetched < now - MAX_AGE_DAYS * 24 * 60 * 60
 
 
 class Icons(object):
     """
-    Heat favicon cache and provide fiepath to cached png file
+    Provide filepath to cached png files and fetch missing favicons in background
 
     Args:
 
@@ -19,7 +237,8 @@ class Icons(object):
 
     def __init__(self, histories: list) -> None:
         """
-        Heat cache of favicon files
+        Load the manifest entries of the results and start download of
+        missing or expired favicons without waiting for it
 
         Args:
 
@@ -28,6 +247,7 @@ class Icons(object):
         """
         self.wf_cache_dir = Tools.getCacheDir()
         self.histories = histories
+        self.icons = dict()
         self._cache_controller()
 
     def get_favion_path(self, url: str) -> str:
@@ -38,59 +258,144 @@ class Icons(object):
             url (str): The URL
 
         Returns:
-            str: Full path to img (PNG) file
-        """
-        netloc = urlparse(url).netloc
-        img = os.path.join(self.wf_cache_dir, f"{netloc}.png")
-        if not (os.path.exists(img)):
-            img = None
-        if img and os.path.getsize(img) == 0:
-            os.remove(img)
-            img = None
-        return img
-
-    def _cache_favicon(self, netloc: str) -> None:
+            str: Full path to img (PNG) file or None if not cached (yet)
         """
-        Download favicon from domain and save in wf cache directory
-
-        Args:
-            netloc (str): Network location e.g. http://www.google.com = www.google.com
-        """
-        if len(netloc) > 0:
-            url = f"https://www.google.com/s2/favicons?domain={netloc}&sz=128"
-            img = os.path.join(self.wf_cache_dir, f"{netloc}.png")
-            os.path.exists(img) and self._cleanup_img_cache(60, img)
-            if not (os.path.exists(img)):
-                req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
-                with open(img, "wb") as f:
-                    try:
-                        with urllib.request.urlopen(req) as r:
-                            f.write(r.read())
-                    except urllib.error.HTTPError as e:
-                        os.path.exists(img) and os.remove(img)
+        entry = self.icons.get(urlparse(url).netloc)
+        if entry and entry[0] and entry[1]:
+            return os.path.join(self.wf_cache_dir, entry[0])
+        return None
 
     def _cache_controller(self) -> None:
         """
-        Cache Controller to heat up cache and invalidation
-
-        Args:
-            histories (list): List with history entries
+        Cache Controller, missing and expired favicons are taken from the
+        browsers' Favicons databases. The rest is handed over to the
+        background fetcher, cached (even expired) icons are used meanwhile.
         """
-        domains = [urlparse(i[0]).netloc for i in self.histories]
-        pool = multiprocessing.Pool()
-        pool.map(self._cache_favicon, domains)
+        pages = dict()
+        for i in self.histories:
+            netloc = urlparse(i[0]).netloc
+            if netloc:
+                pages.setdefault(netloc, list()).append(i[0])
+        if not pages:
+            return
+        manifest = FaviconManifest(self.wf_cache_dir)
+        self.icons = manifest.load(list(pages))
+        now = time.time()
+        missing = [d for d in pages if needs_fetch(self.icons.get(d), now)]
+        if missing:
+            local = read_local_favicons({d: pages[d] for d in missing})
+            results = {d: store_icon(self.wf_cache_dir, d, data)
+                       for d, data in local.items()}
+            missing = [d for d in missing if d not in local]
+            # Hosts unknown to the favicon service are retried locally after backoff
+            results.update((d, 0) for d in missing if not is_public_host(d))
+            if results:
+                manifest.update(results)
+                self.icons.update(manifest.load(list(results)))
+            missing = [d for d in missing if is_public_host(d)]
+        manifest.close()
+        if missing:
+            Tools.log(f"Fetch {len(missing)} favicon(s) in background")
+            fetch_in_background(missing)
 
-    def _cleanup_img_cache(self, number_of_days: int, f_path: str) -> None:
-        """
-        Delete cached image after specific amount of days
 
-        Args:
-            number_of_days (int): Numer of days back in history
-            f_path (str): path to file
-        """
-        now = time.time()
-        old = now - number_of_days * 24 * 60 * 60
-        stats = os.stat(f_path)
-        c_time = stats.st_ctime
-        if c_time < old and os.path.isfile(f_path):
-            os.remove(f_path)
+def fetch_in_background(netlocs: list) -> None:
+    """
+    Start a detached fetcher process so the Script Filter output is not delayed
+
+    Args:
+        netlocs (list): Network locations to download favicons for
+    """
+    spawn_detached(__file__, *netlocs)
+
+
+def cached_size(img: str) -> int:
+    """
+    Size of a cached icon which did not expire yet
+
+    Args:
+        img (str): path to icon
+
+    Returns:
+        int: size of the icon or None if it is missing or expired
+    """
+    try:
+        st = os.stat(img)
+    except OSError:
+        return None
+    if st.st_size and st.st_ctime > time.time() - MAX_AGE_DAYS * 24 * 60 * 60:
+        return st.st_size
+    return None
+
+
+def cache_favicon(netloc: str, cache_dir: str) -> int:
+    """
+    Download favicon from domain and save in wf cache directory
+
+    Args:
+        netloc (str): Network location e.g. http://www.google.com = www.google.com
+        cache_dir (str): wf cache directory
+
+    Returns:
+        int: size of the icon, 0 if the lookup failed
+    """
+    import urllib.request
+    url = FAVICON_URL.format(netloc=netloc)
+    img = os.path.join(cache_dir, f"{netloc}.png")
+    # Icon cached before the manifest existed
+    size = cached_size(img)
+    if size:
+        return size
+    try:
+        req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
+        with urllib.request.urlopen(req, timeout=REQUEST_TIMEOUT) as r:
+            data = r.read()
+        if data:
+            atomic_write(img, data)
+        return len(data)
+    except OSError as e:
+        # HTTPError, URLError and timeouts
+        Tools.log(f"Favicon of {netloc} not available: {e}")
+        return 0
+
+
+def fetch_favicons(netlocs: list, cache_dir: str) -> None:
+    """
+    Download favicons with a bounded thread pool, downloads not finished
+    after TOTAL_TIMEOUT seconds are cancelled. Results are recorded in the
+    manifest. One fetcher runs at a time, the others wait for it and skip
+    the netlocs it looked up.
+
+    Args:
+        netlocs (list): Network locations to download favicons for
+        cache_dir (str): wf cache directory
+    """
+    from concurrent.futures import ThreadPoolExecutor, wait
+    netlocs = list(dict.fromkeys(n for n in netlocs if n))
+    if not netlocs:
+        return
+    lock = FileLock(os.path.join(cache_dir, f"{MANIFEST_FILE}.lock"))
+    # A fetcher holds the lock for at most TOTAL_TIMEOUT seconds plus the manifest update
+    if not lock.acquire(TOTAL_TIMEOUT + REQUEST_TIMEOUT):
+        return
+    with lock:
+        manifest = FaviconManifest(cache_dir)
+        try:
+            entries = manifest.load(netlocs)
+            now = time.time()
+            netlocs = [n for n in netlocs if needs_fetch(entries.get(n), now)]
+            if not netlocs:
+                return
+            pool = ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(netlocs)))
+            futures = [pool.submit(cache_favicon, n, cache_dir) for n in netlocs]
+            done, not_done = wait(futures, timeout=TOTAL_TIMEOUT)
+            for f in not_done:
+                f.cancel()
+            pool.shutdown(wait=False)
+            manifest.update({n: f.result() for n, f in zip(netlocs, futures) if f in done})
+        finally:
+            manifest.close()
+
+
+if __name__ == "__main__":
+    fetch_favicons(sys.argv[1:], Tools.getCacheDir())
@@ -1,16 +1,29 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
-import codecs
+import sys
+
+if __name__ == "__main__":
+    # Thin client: let the search daemon answer before anything else is loaded
+    from search_client import query_daemon
+    if query_daemon("bookmarks", sys.argv[1] if len(sys.argv) > 1 else ""):
+        sys.exit(0)
+
 import json
+import marshal
 import os
-import sys
-from plistlib import load
-from typing import Union
+import re
+from itertools import chain
+from operator import itemgetter
 
 from Alfred3 import Items as Items
 from Alfred3 import Tools as Tools
-from Favicon import Icons
 from browser_config import BOOKMARKS_MAP, get_browser_name_from_path
+from file_lock import atomic_write
+from host_filter import is_ignored, parse_ignored
+from matcher import FIELD_SEP, Matcher, SearchIndex, normalize
+from records import BookmarkTable
+from refine_cache import RefinementCache
+from trigram import TrigramIndex, wait_for_build, write_index
 
 
 # Show favicon in results or default wf icon
@@ -20,80 +33,122 @@ show_favicon = Tools.getEnvBool("show_favicon")
 search_operator_default = Tools.getEnv(
     "search_operator_default", "AND").upper() != "OR"
 
+# Match bookmarks regardless of diacritics (e.g. "ecole" finds "École")
+fold_diacritics = Tools.getEnv("fold_diacritics", "0").lower() in ("1", "true")
+
+# Drop bookmarks of the domains excluded from history search as well
+ignored_urls = None
+if Tools.getEnv("bookmarks_ignored_domains", "0").lower() in ("1", "true"):
+    ignored_urls = parse_ignored(Tools.getEnv("ignored_domains", None))
+    ignored_urls = ignored_urls._replace(domains=set(ignored_urls.domains)) if any(ignored_urls) else None
+
+# Show the last results of a query at once while they are updated
+instant_results = Tools.getEnv("instant_results", "1").lower() in ("1", "true")
+
+# Seconds Alfred may show the cached output of a query before running the
+# search again (0 = off), stale output is replaced as soon as the search ran
+result_cache_seconds = Tools.getEnvInt("result_cache_seconds", 0)
+
 BOOKMARKS = list()
 # Get Browser Histories to load based on user configuration
 for k in BOOKMARKS_MAP.keys():
     if Tools.getEnvBool(k):
         BOOKMARKS.append(BOOKMARKS_MAP.get(k))
 
+# Parsed bookmarks per file, reused as long as the file is unchanged
+# (lives as long as the process, e.g. in the search daemon)
+_loaded_bookmarks = dict()
+
+# Bump if the records of the parsed bookmark cache change, the marshal
+# format depends on the python version as well
+BOOKMARK_CACHE_VERSION = (4, sys.version_info[:2], fold_diacritics)
+# Min. combined size of changed bookmark files to parse them in parallel
+# processes, below starting the processes costs more than it saves
+PARALLEL_PARSE_BYTES = 4 * 1024 * 1024
+# Chromium writes the checksum as first key of the Bookmarks file
+CHECKSUM_RE = re.compile(rb'"checksum"\s*:\s*"([0-9a-fA-F]*)"')
+# Min. number of bookmarks of a browser to build a trigram index and to
+# cache the matches of recent queries, smaller lists are scanned faster
+INDEX_MIN_BOOKMARKS = 10000
+
 
-def removeDuplicates(li: list) -> list:
+def removeDuplicates(li, limit: int = None) -> list:
     """
     Removes Duplicates from bookmark file based on URL.
     When same URL exists in multiple browsers, keeps first occurrence.
 
     Args:
-        li(list): list of bookmark entries (name, url, path, browser)
+        li(iterable): bookmark entries (name, url, path, browser)
+        limit(int, optional): stop after limit entries. Defaults to None.
 
     Returns:
         list: filtered bookmark entries with duplicate URLs removed
     """
-    seen_urls = {}
+    seen_urls = set()
     result = []
     for entry in li:
-        url = entry[1]  # URL is at index 1
-        if url not in seen_urls:
-            seen_urls[url] = True
+        if entry.url not in seen_urls:
+            seen_urls.add(entry.url)
             result.append(entry)
+            if len(result) == limit:
+                break
     return result
 
 
-def get_all_urls(the_json: str, browser: str) -> list:
+def iter_chromium_bookmarks(the_json: dict, browser: str):
+    """
+    Walk a Chromium bookmark tree with an explicit stack
+
+    Folder paths are built once per folder and shared by all bookmarks in
+    it. Root-level containers are named by their key (e.g. bookmark_bar →
+    Bookmark Bar).
+
+    Args:
+        the_json (dict): All Bookmarks read from file
+        browser (str): Browser name
+
+    Yields:
+        tuple: Bookmark (name, url, path, browser) in document order
+    """
+    # Entries are (is_container, node, path), path None is the root level
+    stack = [(True, the_json, None)]
+    while stack:
+        is_container, node, path = stack.pop()
+        if is_container:
+            if isinstance(node, list):
+                stack.extend((False, i, path) for i in reversed(node))
+            elif isinstance(node, dict):
+                entries = list()
+                for k, i in node.items():
+                    # Use the key as folder name for root-level containers
+                    container_name = k.replace('_', ' ').title() if k != 'children' else ''
+                    if container_name and isinstance(i, dict) and i.get('type') == 'folder':
+                        entries.append((False, i, container_name))
+                    else:
+                        entries.append((False, i, path))
+                stack.extend(reversed(entries))
+        elif isinstance(node, dict):
+            node_type = node.get('type')
+            if node_type == 'url':
+                yield (node.get('name'), node.get('url'), 'Root' if path is None else path, browser)
+            elif node_type == 'folder':
+                folder_name = node.get('name', 'Unnamed Folder')
+                stack.append((True, node.get('children'),
+                              folder_name if path is None else f"{path} > {folder_name}"))
+
+
+def get_all_urls(the_json: dict, browser: str) -> list:
     """
     Extract all URLs, title, and folder path from Bookmark files
 
     Args:
-        the_json (str): All Bookmarks read from file
+        the_json (dict): All Bookmarks read from file
         browser (str): Browser name
 
     Returns:
-        list(tuple): List of tuple with Bookmarks (name, url, path, browser)
-    """
-    def extract_data(data: dict, path: list):
-        if isinstance(data, dict) and data.get('type') == 'url':
-            folder_path = ' > '.join(path) if path else 'Root'
-            urls.append({
-                'name': data.get('name'),
-                'url': data.get('url'),
-                'path': folder_path
-            })
-        if isinstance(data, dict) and data.get('type') == 'folder':
-            folder_name = data.get('name', 'Unnamed Folder')
-            the_children = data.get('children')
-            new_path = path + [folder_name]
-            get_container(the_children, new_path)
-
-    def get_container(o: Union[list, dict], path: list = []):
-        if isinstance(o, list):
-            for i in o:
-                extract_data(i, path)
-        if isinstance(o, dict):
-            for k, i in o.items():
-                # Use the key as folder name for root-level containers
-                container_name = k.replace('_', ' ').title() if k not in [
-                    'children'] else ''
-                if container_name and isinstance(i, dict) and i.get('type') == 'folder':
-                    extract_data(i, [container_name]
-                                 if container_name else path)
-                else:
-                    extract_data(i, path)
-
-    urls = list()
-    get_container(the_json)
-    s_list_dict = sorted(urls, key=lambda k: k['name'], reverse=False)
-    ret_list = [(l.get('name'), l.get('url'), l.get('path'), browser)
-                for l in s_list_dict]
-    return ret_list
+        list(tuple): List of tuple with Bookmarks (name, url, path, browser) sorted by name
+    """
+    return sorted(iter_chromium_bookmarks(the_json, browser), key=itemgetter(0))
 
 
 def paths_to_bookmarks() -> list:
@@ -126,34 +181,37 @@ def get_json_from_file(file: str) -> json:
     Returns:
         str: JSON of Bookmarks
     """
-    return json.load(codecs.open(file, 'r', 'utf-8-sig'))['roots']
+    with open(file, 'r', encoding='utf-8-sig') as f:
+        return json.load(f)['roots']
 
 
-def extract_safari_bookmarks(bookmark_data, bookmarks_list, path=[], browser="safari") -> None:
+def iter_safari_bookmarks(bookmark_data, browser: str = "safari"):
     """
-    Recursively extract bookmarks (title, URL, path, and browser) from Safari bookmarks data.
+    Walk Safari bookmarks data with an explicit stack, folder paths are
+    built once per folder and shared by all bookmarks in it
+
     Args:
         bookmark_data (list or dict): The Safari bookmarks data, which can be a list or a dictionary.
-        bookmarks_list (list): The list to which extracted bookmarks (title, URL, path, browser) will be appended.
-        path (list): Current folder path as a list of folder names.
         browser (str): Browser name (default: "safari")
-    Returns:
-        None
-    """
-    if isinstance(bookmark_data, list):
-        for item in bookmark_data:
-            extract_safari_bookmarks(item, bookmarks_list, path, browser)
-    elif isinstance(bookmark_data, dict):
-        if "Children" in bookmark_data:
-            folder_name = bookmark_data.get("Title", "")
-            new_path = path + [folder_name] if folder_name else path
-            extract_safari_bookmarks(
-                bookmark_data["Children"], bookmarks_list, new_path, browser)
-        elif "URLString" in bookmark_data and "URIDictionary" in bookmark_data:
-            title = bookmark_data["URIDictionary"].get("title", "Untitled")
-            url = bookmark_data["URLString"]
-            folder_path = ' > '.join(path) if path else 'Root'
-            bookmarks_list.append((title, url, folder_path, browser))
+
+    Yields:
+        tuple: Bookmark (title, URL, path, browser) in document order
+    """
+    # Entries are (node, path), path None is the root level
+    stack = [(bookmark_data, None)]
+    while stack:
+        node, path = stack.pop()
+        if isinstance(node, list):
+            stack.extend((i, path) for i in reversed(node))
+        elif isinstance(node, dict):
+            if "Children" in node:
+                folder_name = node.get("Title", "")
+                if folder_name:
+                    path = folder_name if path is None else f"{path} > {folder_name}"
+                stack.append((node["Children"], path))
+            elif "URLString" in node and "URIDictionary" in node:
+                title = node["URIDictionary"].get("title", "Untitled")
+                yield (title, node["URLString"], 'Root' if path is None else path, browser)
 
 
 def get_safari_bookmarks_json(file: str, browser: str = "safari") -> list:
@@ -168,37 +226,270 @@ def get_safari_bookmarks_json(file: str, browser: str = "safari") -> list:
         list: List of bookmarks (title, URL, path, and browser)
 
     """
+    from plistlib import load
     with open(file, "rb") as fp:
         plist = load(fp)
-    bookmarks = []
-    extract_safari_bookmarks(plist, bookmarks, [], browser)
+    return list(iter_safari_bookmarks(plist, browser))
+
+
+def read_checksum(bookmarks_file: str) -> str:
+    """
+    Read checksum of a Chromium Bookmarks file without parsing it
+
+    Args:
+        bookmarks_file (str): Path to bookmark file
+
+    Returns:
+        str: checksum or None (e.g. Safari)
+    """
+    with open(bookmarks_file, "rb") as f:
+        m = CHECKSUM_RE.search(f.read(256))
+    return m.group(1).decode() if m else None
+
+
+def bookmark_cache_path(bookmarks_file: str, suffix: str = "cache") -> str:
+    """
+    Path of the parsed bookmark cache of a bookmark file
+
+    Args:
+        bookmarks_file (str): Path to bookmark file
+        suffix (str, optional): "cache" or "trigrams" for the trigram index. Defaults to "cache".
+
+    Returns:
+        str: path in wf cache directory
+    """
+    browser = get_browser_name_from_path(bookmarks_file, "bookmarks")
+    return os.path.join(Tools.getCacheDir(), f"bookmarks_{browser}.{suffix}")
+
+
+def read_bookmark_cache(bookmarks_file: str, signature: tuple) -> BookmarkTable:
+    """
+    Read parsed bookmarks from the cache in wf cache directory. Cache is
+    valid if the file did not change or, for Chromium, if the checksum
+    of the file is still the same.
+
+    Args:
+        bookmarks_file (str): Path to bookmark file
+        signature (tuple): inode, size and mtime of the bookmark file
+
+    Returns:
+        BookmarkTable: bookmarks or None
+    """
+    cache_file = bookmark_cache_path(bookmarks_file)
+    try:
+        with open(cache_file, "rb") as f:
+            version, path, cached_signature, parsed, checksum, dumped = marshal.loads(f.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if version != BOOKMARK_CACHE_VERSION or path != bookmarks_file:
+        return None
+    bookmarks = BookmarkTable.load(dumped)
+    bookmarks.origin = (bookmarks_file, tuple(parsed))
+    if tuple(cached_signature) == signature:
+        attach_trigram_index(bookmarks_file, parsed, bookmarks)
+        return bookmarks
+    if checksum and checksum == read_checksum(bookmarks_file):
+        # Rewritten with same content, keep the cache
+        write_bookmark_cache(bookmarks_file, signature, checksum, bookmarks, parsed)
+        attach_trigram_index(bookmarks_file, parsed, bookmarks)
+        return bookmarks
+    return None
+
+
+def write_bookmark_cache(bookmarks_file: str, signature: tuple, checksum: str, bookmarks: BookmarkTable, parsed: tuple = None) -> None:
+    """
+    Write parsed bookmarks into the cache in wf cache directory
+
+    Args:
+        bookmarks_file (str): Path to bookmark file
+        signature (tuple): inode, size and mtime of the bookmark file
+        checksum (str): Chromium checksum of the bookmark file or None
+        bookmarks (BookmarkTable): bookmarks
+        parsed (tuple, optional): signature of the file the bookmarks were parsed from,
+            None if they were just parsed (the trigram index is built then). Defaults to None.
+    """
+    if parsed is None:
+        parsed = signature
+        bookmarks.origin = (bookmarks_file, parsed)
+        write_trigram_index(bookmarks_file, parsed, bookmarks)
+    try:
+        atomic_write(bookmark_cache_path(bookmarks_file), marshal.dumps(
+            (BOOKMARK_CACHE_VERSION, bookmarks_file, signature, parsed, checksum, bookmarks.dump())))
+    except OSError as e:
+        Tools.log(f"Bookmark cache not written: {e}")
+
+
+def write_trigram_index(bookmarks_file: str, parsed: tuple, bookmarks: BookmarkTable) -> None:
+    """
+    Build the trigram index of the search keys of a large bookmark list
+    and attach it to the bookmarks
+
+    Args:
+        bookmarks_file (str): Path to bookmark file
+        parsed (tuple): signature of the file the bookmarks were parsed from
+        bookmarks (BookmarkTable): bookmarks
+    """
+    if len(bookmarks) < INDEX_MIN_BOOKMARKS:
+        return
+    index_file = bookmark_cache_path(bookmarks_file, "trigrams")
+    try:
+        if not write_index(index_file, enumerate(bookmarks.keys),
+                           (BOOKMARK_CACHE_VERSION, bookmarks_file, parsed, len(bookmarks))):
+            # Another process indexes the same bookmarks, use its index
+            wait_for_build(index_file)
+    except OSError as e:
+        Tools.log(f"Trigram index not written: {e}")
+        return
+    attach_trigram_index(bookmarks_file, parsed, bookmarks)
+
+
+def attach_trigram_index(bookmarks_file: str, parsed: tuple, bookmarks: BookmarkTable) -> None:
+    """
+    Map the trigram index of a bookmark list if it was built from the same bookmarks
+
+    Args:
+        bookmarks_file (str): Path to bookmark file
+        parsed (tuple): signature of the file the bookmarks were parsed from
+        bookmarks (BookmarkTable): bookmarks
+    """
+    if len(bookmarks) < INDEX_MIN_BOOKMARKS:
+        return
+    trigrams = TrigramIndex.open(bookmark_cache_path(bookmarks_file, "trigrams"))
+    if trigrams is None or trigrams.meta != (BOOKMARK_CACHE_VERSION, bookmarks_file, tuple(parsed), len(bookmarks)):
+        Tools.log(f"No trigram index of {bookmarks_file}")
+        trigrams and trigrams.close()
+        return
+    bookmarks.index = SearchIndex(bookmarks.keys, trigrams)
+
+
+def file_signature(bookmarks_file: str) -> tuple:
+    st = os.stat(bookmarks_file)
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def cached_bookmarks(bookmarks_file: str, signature: tuple) -> BookmarkTable:
+    """
+    Parsed bookmarks from memory or from wf cache directory
+
+    Args:
+        bookmarks_file (str): Path to bookmark file
+        signature (tuple): inode, size and mtime of the bookmark file
+
+    Returns:
+        BookmarkTable: bookmarks or None if file changed
+    """
+    cached = _loaded_bookmarks.get(bookmarks_file)
+    if cached and cached[0] == signature:
+        return cached[1]
+    bookmarks = read_bookmark_cache(bookmarks_file, signature)
+    if bookmarks is not None:
+        Tools.log(f"Loaded {len(bookmarks)} bookmarks from cache of {bookmarks_file}")
+        _loaded_bookmarks[bookmarks_file] = (signature, bookmarks)
     return bookmarks
 
 
-def match(search_term: str, results: list) -> list:
+def parse_bookmarks(bookmarks_file: str) -> tuple:
     """
-    Filters a list of tuples based on a search term.
+    Parse a bookmark file, runs in a worker process when several files are parsed
+
     Args:
-        search_term (str): The term to search for. Can include '&' or '|' to specify AND or OR logic.
-                          If empty, returns all results.
-        results (list): A list of tuples (name, url, path, browser) to search within.
+        bookmarks_file (str): Path to bookmark file
+
+    Returns:
+        tuple: (Chromium checksum or None, BookmarkTable)
+    """
+    browser = get_browser_name_from_path(bookmarks_file, "bookmarks")
+    checksum = None
+    if "Safari" in bookmarks_file:
+        bookmarks = get_safari_bookmarks_json(bookmarks_file, browser)
+        Tools.log(f"Loaded {len(bookmarks)} Safari bookmarks")
+    else:
+        checksum = read_checksum(bookmarks_file)
+        bm_json = get_json_from_file(bookmarks_file)
+        bookmarks = get_all_urls(bm_json, browser)
+        Tools.log(
+            f"Loaded {len(bookmarks)} bookmarks from {bookmarks_file}")
+    table = BookmarkTable.from_records(bookmarks, browser)
+    table.keys = bookmark_keys(table)
+    return checksum, table
+
+
+def bookmark_keys(table: BookmarkTable) -> list:
+    """
+    Search keys (name, url, folder path) of all bookmarks of a table
+
+    Args:
+        table (BookmarkTable): bookmarks
+
+    Returns:
+        list: search key per bookmark
+    """
+    # Folder paths are shared by many bookmarks, normalize them once
+    folders = [normalize(f, fold_diacritics) for f in table.folders]
+    return [f"{normalize(str(name), fold_diacritics)}{FIELD_SEP}{normalize(str(url), fold_diacritics)}{FIELD_SEP}{folders[folder_id]}"
+            for name, url, folder_id in zip(table.names, table.urls, table.folder_ids)]
+
+
+def load_bookmarks(bookmarks_file: str) -> BookmarkTable:
+    """
+    Load bookmarks of a browser, parsed files are kept in memory and in
+    wf cache directory until they change
+
+    Args:
+        bookmarks_file (str): Path to bookmark file
+
+    Returns:
+        BookmarkTable: bookmarks
+    """
+    return load_all_bookmarks([bookmarks_file])[0]
+
+
+def load_all_bookmarks(bookmarks_files: list) -> list:
+    """
+    Load bookmarks of several browsers. Changed files are parsed in
+    parallel worker processes if it pays off (PARALLEL_PARSE_BYTES).
+
+    Args:
+        bookmarks_files (list): Paths to bookmark files
+
     Returns:
-        list: A list of tuples that match the search term based on the specified logic.
+        list: BookmarkTable per file, in order of bookmarks_files
+    """
+    signatures = {f: file_signature(f) for f in bookmarks_files}
+    loaded = {f: cached_bookmarks(f, signatures[f]) for f in bookmarks_files}
+    changed = [f for f in bookmarks_files if loaded[f] is None]
+    workers = min(len(changed), os.cpu_count() or 1)
+    if workers > 1 and sum(signatures[f][1] for f in changed) >= PARALLEL_PARSE_BYTES:
+        from concurrent.futures import ProcessPoolExecutor
+        Tools.log(f"Parse {len(changed)} bookmark files in {workers} processes")
+        with ProcessPoolExecutor(workers) as ex:
+            parsed = list(ex.map(parse_bookmarks, changed))
+    else:
+        parsed = [parse_bookmarks(f) for f in changed]
+    for f, (checksum, bookmarks) in zip(changed, parsed):
+        write_bookmark_cache(f, signatures[f], checksum, bookmarks)
+        _loaded_bookmarks[f] = (signatures[f], bookmarks)
+        loaded[f] = bookmarks
+    return [loaded[f] for f in bookmarks_files]
+
+
+def match(search_term: str, bookmarks: BookmarkTable, refinements: RefinementCache = None):
+    """
+    Filters bookmarks based on a search term.
+    Args:
+        search_term (str): The term to search for. Can include '&' or '|' to specify AND or OR logic.
+                          If empty, returns all bookmarks.
+        bookmarks (BookmarkTable): The bookmarks to search within.
+        refinements (RefinementCache, optional): cache of recent queries, used for large
+                          bookmark lists and AND logic. Defaults to None.
+    Yields:
+        Bookmark: bookmarks that match the search term based on the specified logic, in order.
     """
-    # If no search term, return all results
+    # If no search term, return all bookmarks
     if not search_term:
-        return results
-    
-    def is_in_tuple(tple: tuple, st: str) -> bool:
-        # Search in name, url, path (but not browser)
-        # Only search first 3 elements for better performance
-        for e in tple[:3]:
-            if st.lower() in str(e).lower():
-                return True  # Early exit on first match
-        return False
-
-    result_lst = []
-    
+        yield from bookmarks
+        return
+
     # Parse search terms once
     if '&' in search_term:
         search_terms = search_term.split('&')
@@ -209,15 +500,36 @@ def match(search_term: str, results: list) -> list:
     else:
         search_terms = search_term.split()
         use_and_logic = search_operator_default
-    
-    # Determine check function once before loop
-    check_func = all if use_and_logic else any
 
-    for r in results:
-        if check_func(is_in_tuple(r, ts) for ts in search_terms):
-            result_lst.append(r)
+    # Search in name, url, path (but not browser)
+    if bookmarks.index is None:
+        bookmarks.index = SearchIndex(bookmarks.keys)
+    matcher = Matcher(search_terms, use_and_logic, fold_diacritics)
+    if (refinements is None or not use_and_logic or not matcher.terms
+            or bookmarks.origin is None or len(bookmarks) < INDEX_MIN_BOOKMARKS):
+        rows = matcher.scan(bookmarks.index)
+    else:
+        # Only check the matches of a previous keystroke
+        scope = f"bookmarks_{bookmarks.browser}"
+        state = repr((BOOKMARK_CACHE_VERSION, bookmarks.origin))
+        rows = matcher.scan(bookmarks.index, refinements.lookup(scope, state, matcher.terms))
+        refinements.store(scope, state, matcher.terms, rows)
+    for i in rows:
+        yield bookmarks[i]
+
 
-    return result_lst
+def source_files() -> list:
+    """
+    Files the Script Filter output depends on
+
+    Returns:
+        list: Bookmarks files and the favicon manifest if favicons are shown
+    """
+    files = paths_to_bookmarks()
+    if show_favicon:
+        from Favicon import MANIFEST_FILE
+        files.append(os.path.join(Tools.getCacheDir(), MANIFEST_FILE))
+    return files
 
 
 def main():
@@ -228,54 +540,70 @@ def main():
         Tools.log("Python version 3.7.0 or higher required!")
         sys.exit(0)
 
+    query = Tools.getArgv(1) if Tools.getArgv(1) is not None else str()
+    if instant_results:
+        from result_cache import cached_items
+        wf = cached_items("bookmarks", query, source_files(), get_items)
+    else:
+        wf = get_items(query)
+    wf.write()
+
+
+def get_items(query: str) -> Items:
+    """
+    Search bookmarks and generate Script Filter items
+
+    Args:
+        query (str): search query, empty returns all bookmarks (max. 30)
+
+    Returns:
+        Items: Script Filter items
+    """
     # Workflow item object
     wf = Items()
-    query = Tools.getArgv(1) if Tools.getArgv(1) is not None else str()
+    if result_cache_seconds > 0:
+        wf.setCache(result_cache_seconds, loosereload=True)
     Tools.log(f"Search query: '{query}'")
     bms = paths_to_bookmarks()
     Tools.log(f"Found {len(bms)} bookmark file(s)")
 
     if len(bms) > 0:
-        matches = list()
-        # Generate list of bookmarks matches the search
-        bookmarks = []
-        for bookmarks_file in bms:
-            browser = get_browser_name_from_path(bookmarks_file, "bookmarks")
-            if "Safari" in bookmarks_file:
-                bookmarks = get_safari_bookmarks_json(bookmarks_file, browser)
-                Tools.log(f"Loaded {len(bookmarks)} Safari bookmarks")
-               # pass
-            else:
-                bm_json = get_json_from_file(bookmarks_file)
-                bookmarks = get_all_urls(bm_json, browser)
-                Tools.log(
-                    f"Loaded {len(bookmarks)} bookmarks from {bookmarks_file}")
-            matches.extend(match(query, bookmarks))
-        # finally remove duplicates from all browser bookmarks
-        matches = removeDuplicates(matches)
-        Tools.log(f"Total matches after deduplication: {len(matches)}")
-        # Limit to top 30 results
-        matches = matches[:30]
-        # generate list of matches for Favicon download
-        ico_matches = []
-        if show_favicon:
-            ico_matches = [(i2, i1) for i1, i2, i3, i4 in matches]
+        all_bookmarks = load_all_bookmarks(bms)
+        refinements = None
+        if query and any(len(b) >= INDEX_MIN_BOOKMARKS for b in all_bookmarks):
+            refinements = RefinementCache()
+        try:
+            # Matches of all browsers in order of the browsers so
+            # removeDuplicates() keeps the same entry
+            matches = chain.from_iterable(
+                match(query, bookmarks, refinements) for bookmarks in all_bookmarks)
+            if ignored_urls:
+                matches = (m for m in matches if not is_ignored(m.url, ignored_urls))
+            # finally remove duplicates, limited to top 30 results
+            matches = removeDuplicates(matches, 30)
+        finally:
+            refinements and refinements.close()
+        Tools.log(f"Matches after deduplication: {len(matches)}")
         # Heat Favicon Cache
-        ico = Icons(ico_matches)
+        if show_favicon:
+            from Favicon import Icons
+            # generate list of matches for Favicon download
+            ico_matches = [(m.url, m.name) for m in matches]
+            ico = Icons(ico_matches)
         # generate script filter output
         for m in matches:
-            url = m[1]
+            url = m.url
             # Safely extract name or domain from URL
-            if m[0]:
-                name = m[0]
+            if m.name:
+                name = m.name
             else:
                 # Try to extract domain, fallback to full URL if it fails
                 try:
                     name = url.split('/')[2]
                 except IndexError:
                     name = url
-            path = m[2] if len(m) > 2 else 'Unknown'
-            browser = m[3] if len(m) > 3 else 'unknown'
+            path = m.path
+            browser = m.browser
             # Combine url and browser with pipe separator
             url_with_browser = f"{url}|{browser}"
             Tools.log(f"Bookmark: '{name}' | Path: '{path}' | Browser: '{browser}'")
@@ -316,7 +644,7 @@ def main():
             arg=f'https://www.google.com/search?q={query}'
         )
         wf.addItem()
-    wf.write()
+    return wf
 
 
 if __name__ == "__main__":
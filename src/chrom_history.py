@@ -1,19 +1,31 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
+import sys
+
+if __name__ == "__main__":
+    # Thin client: let the search daemon answer before anything else is loaded
+    from search_client import query_daemon
+    if query_daemon("history", sys.argv[1] if len(sys.argv) > 1 else ""):
+        sys.exit(0)
+
+import heapq
 import os
-import shutil
 import sqlite3
-import sys
 import time
-import uuid
-from multiprocessing.pool import ThreadPool as Pool
+from operator import itemgetter
 from unicodedata import normalize
 
 from Alfred3 import AlfJson as AlfJson
 from Alfred3 import Items as Items
 from Alfred3 import Tools as Tools
 from browser_config import HISTORY_MAP, get_browser_name_from_path
-from Favicon import Icons
+from generation import checkpoint, run
+from history_mirror import MIRROR_FILE, HistoryMirror, unique_urls
+from host_filter import parse_ignored
+from records import HistoryEntry
+from refine_cache import RefinementCache
+from snapshot import MAX_ATTACHED, open_snapshots
+from sql_filter import SqlFilter, register_functions
 
 # Get Browser Histories to load per env (true/false)
 HISTORIES = list()
@@ -21,9 +33,8 @@ for k in HISTORY_MAP.keys():
     if Tools.getEnvBool(k):
         HISTORIES.append(HISTORY_MAP.get(k))
 
-# Get ignored Domains settings
-d = Tools.getEnv("ignored_domains", None)
-ignored_domains = d.split(',') if d else None
+# Get ignored Domains settings, subdomains are ignored as well
+ignored_urls = parse_ignored(Tools.getEnv("ignored_domains", None))
 
 # Show favicon in results or default wf icon
 show_favicon = Tools.getEnvBool("show_favicon")
@@ -36,9 +47,26 @@ search_operator_default = Tools.getEnv(
 # based on recent visitied otherwise number of visits
 sort_recent = Tools.getEnvBool("sort_recent")
 
+# Show the last results of a query at once while they are updated
+instant_results = Tools.getEnv("instant_results", "1").lower() in ("1", "true")
+
+# Seconds Alfred may show the cached output of a query before running the
+# search again (0 = off), stale output is replaced as soon as the search ran
+result_cache_seconds = Tools.getEnvInt("result_cache_seconds", 0)
+
+# Milliseconds to wait for outdated History files, results of the ones
+# read later are taken from the last sync meanwhile (0 = wait for all)
+search_budget_ms = Tools.getEnvInt("search_budget_ms", 1000)
+
 # Date format settings
 DATE_FMT = Tools.getEnv("date_format", default='%d. %B %Y')
 
+# Max number of history entries shown in Alfred
+RESULT_LIMIT = 30
+
+# Rows fetched from SQLite at once when streaming entries
+FETCH_SIZE = 1000
+
 
 def history_paths() -> list:
     """
@@ -73,108 +101,170 @@ def get_histories(dbs: list, query: str = "") -> list:
         list: filters history entries
     """
 
-    results = list()
-    with Pool(len(dbs)) as p:  # Exec in ThreadPool
-        # Pass both db path and browser name to sql function
-        db_browser_pairs = [
-            (db, get_browser_name_from_path(db, "history")) for db in dbs]
-        results = p.starmap(sql, db_browser_pairs)
-    # Flatten results using list comprehension for better performance
-    matches = [item for r in results for item in r]
-
-    # Only filter by search terms if query is provided
-    if query:
-        results = search_in_tuples(matches, query)
-    else:
-        results = matches
-
-    # Remove duplicate Entries
-    results = removeDuplicates(results)
-    # Remove ignored domains
-    if ignored_domains:
-        results = remove_ignored_domains(results, ignored_domains)
-    # Sort by element. Element 2=visits, 3=timestamp (recent)
-    sort_by = 3 if sort_recent else 2
-    # Sort based on visits or recency
-    results = Tools.sortListTuple(results, sort_by)
-    # Reduce search results to 30 AFTER sorting
-    results = results[:30]
-    return results
-
-
-def remove_ignored_domains(results: list, ignored_domains: list) -> list:
+    # Pass both db path and browser name to sql function
+    db_browser_pairs = [
+        (db, get_browser_name_from_path(db, "history")) for db in dbs]
+    sql_filter = get_sql_filter(query)
+    try:
+        return mirrored_histories(db_browser_pairs, sql_filter)
+    except sqlite3.Error as e:
+        Tools.log(f"History mirror not available: {e}")
+    if len(dbs) <= MAX_ATTACHED:
+        return list(sql(db_browser_pairs, sql_filter, RESULT_LIMIT))
+
+    # More History files than SQLite attaches to one connection: the rows
+    # of each group of files stream through the dedupe into the top entries
+    groups = [db_browser_pairs[i:i + MAX_ATTACHED]
+              for i in range(0, len(db_browser_pairs), MAX_ATTACHED)]
+    # A LIMIT per group is only safe if ranking does not depend on the
+    # entry removeDuplicates() keeps for URLs found in multiple groups
+    limit = RESULT_LIMIT if not sort_recent else None
+    return top_entries((e for g in groups for e in sql(g, sql_filter, limit)), RESULT_LIMIT)
+
+
+def top_entries(entries, limit: int) -> list:
     """
-    removes results based on domain ignore list
+    Select the top entries from a stream of history entries, holds only the
+    best entry per URL and never sorts all of them
 
     Args:
-        results (list): History results list with tubles
-        ignored_domains (list): list of domains to ignore
+        entries (iterable): HistoryEntry of several browsers
+        limit (int): max entries
 
     Returns:
-        list: _description_
+        list: up to limit entries, one per URL, sorted by visits or last visit
     """
-    new_results = list()
-    if len(ignored_domains) > 0:
-        for r in results:
-            for i in ignored_domains:
-                inner_result = r
-                if i in r[0]:
-                    inner_result = None
-                    break
-            if inner_result:
-                new_results.append(inner_result)
-    else:
-        new_results = results
-    return new_results
+    # Element 2=visits, 3=timestamp (recent), same order as in SQL
+    sort_by = itemgetter(3) if sort_recent else itemgetter(2, 3)
+    return heapq.nlargest(limit, removeDuplicates(entries), key=sort_by)
 
 
-def sql(db: str, browser: str) -> list:
+def get_sql_filter(query: str) -> SqlFilter:
     """
-    Executes SQL depending on History path
-    provided in db: str
+    Compile search query and ignored domains into a SQL filter
+
+    Args:
+        query (str): search query, empty matches everything
+
+    Returns:
+        SqlFilter: filter for the history queries
+    """
+    if not query:
+        return SqlFilter([], True, ignored_urls)
+    use_and_logic = ("&" in query) or (
+        "|" not in query and search_operator_default)
+    return SqlFilter(get_search_terms(query), use_and_logic, ignored_urls)
+
+
+def mirrored_histories(db_browser_pairs: list, sql_filter: SqlFilter) -> list:
+    """
+    Sync History files incrementally into the mirror and load entries from it
+
+    Args:
+        db_browser_pairs (list): list of tuples (History path, Browser name)
+        sql_filter (SqlFilter): search filter
+
+    Returns:
+        list: result list of HistoryEntry, one per url
+    """
+    mirror = HistoryMirror()
+    refinements = RefinementCache()
+    try:
+        late = mirror.sync(
+            db_browser_pairs, search_budget_ms / 1000 if search_budget_ms > 0 else None)
+        if late:
+            Tools.log(f"Results of {', '.join(late)} are from the last sync")
+        checkpoint("snapshot")
+        mirror.update_index()
+        return mirror.query([b for _, b in db_browser_pairs], sql_filter, sort_recent, RESULT_LIMIT, refinements)
+    finally:
+        refinements.close()
+        mirror.close()
+
+
+def select_statement(db: str, schema: str, sql_filter: SqlFilter) -> tuple:
+    """
+    SQL statement selecting the matching entries of a History file, one
+    row per URL with url, title, visit_count, last_visit and browser
 
     Args:
         db (str): Path to History file
-        browser (str): Browser name
+        schema (str): schema the History file is attached as
+        sql_filter (SqlFilter): search filter
 
     Returns:
-        list: result list of tuples (Url, Title, VisiCount, Timestamp, Browser)
+        tuple: (SQL statement, parameters without the browser name)
     """
-    res = []
-    history_db = f"/tmp/{uuid.uuid1()}"
+    # SQL satement for Safari, title of the latest matching visit
+    if "Safari" in db:
+        where, params = sql_filter.clause(
+            "py_host(history_items.url)",
+            ("history_items.url", "history_visits.title"),
+            ("history_items.visit_count", "(history_visits.visit_time + 978307200)"))
+        return f"""
+            SELECT history_items.url AS url, history_visits.title AS title, history_items.visit_count AS visit_count,
+                (MAX(history_visits.visit_time) + 978307200) AS last_visit, ? AS browser
+            FROM {schema}.history_items AS history_items
+                INNER JOIN {schema}.history_visits AS history_visits
+                ON history_visits.history_item = history_items.id
+            WHERE history_items.url IS NOT NULL AND
+                history_visits.title IS NOT NULL AND
+                history_items.url != '' AND
+                {where}
+            GROUP BY history_items.id""", params
+    # SQL statement for Chromium Brothers, urls visited at least once
+    where, params = sql_filter.clause(
+        "py_host(urls.url)",
+        ("urls.url", "urls.title"),
+        ("urls.visit_count", "(urls.last_visit_time/1000000 + (strftime('%s', '1601-01-01')))"))
+    return f"""
+        SELECT urls.url AS url, urls.title AS title, urls.visit_count AS visit_count,
+            (urls.last_visit_time/1000000 + (strftime('%s', '1601-01-01'))) AS last_visit, ? AS browser
+        FROM {schema}.urls AS urls
+        WHERE EXISTS (SELECT 1 FROM {schema}.visits AS visits WHERE visits.url = urls.id) AND
+            urls.title IS NOT NULL AND
+            urls.title != '' AND
+            {where}""", params
+
+
+def sql(db_browser_pairs: list, sql_filter: SqlFilter, limit: int = None):
+    """
+    Executes one SQL statement over all History files attached to a
+    single connection. Yields one row per URL, fetched in batches.
+
+    Args:
+        db_browser_pairs (list): list of tuples (History path, Browser name)
+        sql_filter (SqlFilter): search filter
+        limit (int, optional): max entries. Defaults to None.
+
+    Yields:
+        HistoryEntry: entries ordered by visits or last visit
+    """
+    count = 0
+    start = time.perf_counter()
     try:
-        shutil.copy2(db, history_db)
-        with sqlite3.connect(history_db) as c:
-            cursor = c.cursor()
-            # SQL satement for Safari
-            if "Safari" in db:
-                select_statement = f"""
-                    SELECT history_items.url, history_visits.title, history_items.visit_count,(history_visits.visit_time + 978307200)
-                    FROM history_items
-                        INNER JOIN history_visits
-                        ON history_visits.history_item = history_items.id
-                    WHERE history_items.url IS NOT NULL AND
-						history_visits.TITLE IS NOT NULL AND
-						history_items.url != '' order by visit_time DESC
-                """
-            # SQL statement for Chromium Brothers
-            else:
-                select_statement = f"""
-                    SELECT DISTINCT urls.url, urls.title, urls.visit_count, (urls.last_visit_time/1000000 + (strftime('%s', '1601-01-01')))
-                    FROM urls, visits
-                    WHERE urls.id = visits.url AND
-                    urls.title IS NOT NULL AND
-                    urls.title != '' order by last_visit_time DESC; """
-            Tools.log(select_statement)
-            cursor.execute(select_statement)
-            r = cursor.fetchall()
-            # Add browser name to each tuple
-            res.extend([(*row, browser) for row in r])
-        os.remove(history_db)  # Delete History file in /tmp
+        with open_snapshots([db for db, _ in db_browser_pairs]) as c:
+            checkpoint("snapshot")
+            register_functions(c)
+            arms = list()
+            params = list()
+            for i, (db, browser) in enumerate(db_browser_pairs):
+                arm, arm_params = select_statement(db, f"db{i}", sql_filter)
+                arms.append(arm)
+                params.extend([browser, *arm_params])
+            statement = unique_urls(arms, sort_recent, limit)
+            Tools.log(statement)
+            cursor = c.execute(statement, params)
+            rows = cursor.fetchmany(FETCH_SIZE)
+            while rows:
+                count += len(rows)
+                yield from (HistoryEntry(*row) for row in rows)
+                rows = cursor.fetchmany(FETCH_SIZE)
     except sqlite3.Error as e:
         Tools.log(f"SQL Error: {e}")
         sys.exit(1)
-    return res
+    Tools.log(
+        f"{', '.join(b for _, b in db_browser_pairs)}: {count} rows in {(time.perf_counter() - start) * 1000:.1f} ms")
 
 
 def get_search_terms(search: str) -> tuple:
@@ -206,58 +296,21 @@ def removeDuplicates(li: list) -> list:
     If visits are equal, keeps the most recent entry.
 
     Args:
-        li(list): list of history entries (url, title, visits, timestamp, browser)
+        li(iterable): HistoryEntry, consumed once
 
     Returns:
         list: filtered history entries with duplicates removed
     """
     unique_entries = {}
-    for url, title, visits, timestamp, browser in li:
-        if url not in unique_entries:
-            unique_entries[url] = (url, title, visits, timestamp, browser)
-        else:
-            # Keep entry with more visits, or more recent if visits are equal
-            existing = unique_entries[url]
-            if visits > existing[2] or (visits == existing[2] and timestamp > existing[3]):
-                unique_entries[url] = (url, title, visits, timestamp, browser)
+    for entry in li:
+        existing = unique_entries.get(entry.url)
+        # Keep entry with more visits, or more recent if visits are equal
+        if existing is None or entry.visits > existing.visits or (
+                entry.visits == existing.visits and entry.last_visit > existing.last_visit):
+            unique_entries[entry.url] = entry
     return list(unique_entries.values())
 
 
-def search_in_tuples(tuples: list, search: str) -> list:
-    """
-    Search for search term in list of tuples
-
-    Args:
-        tuples(list): List contains tuple to search
-        search(str): Search string (multiple words default to AND)
-
-    Returns:
-        list: tuple list with result of query string
-    """
-
-    def is_in_tuple(tple: tuple, st: str) -> bool:
-        # Search only first 4 elements (url, title, visits, timestamp)
-        # Skip browser name at index 4 for better performance
-        for e in tple[:4]:
-            if st.lower() in str(e).lower():
-                return True  # Early exit on first match
-        return False
-
-    search_terms = get_search_terms(search)
-    result = list()
-
-    # Determine search logic once before loop for better performance
-    use_and_logic = ("&" in search) or (
-        "|" not in search and search_operator_default)
-    check_func = all if use_and_logic else any
-
-    for t in tuples:
-        if check_func(is_in_tuple(t, ts) for ts in search_terms):
-            result.append(t)
-
-    return result
-
-
 def formatTimeStamp(time_ms: int, fmt: str = '%d. %B %Y') -> str:
     """
     Time Stamp (ms) into formatted date string
@@ -275,6 +328,21 @@ def formatTimeStamp(time_ms: int, fmt: str = '%d. %B %Y') -> str:
     return t_string
 
 
+def source_files() -> list:
+    """
+    Files the Script Filter output depends on
+
+    Returns:
+        list: History files, the mirror and the favicon manifest if favicons are shown
+    """
+    # The mirror changes when sources are synced in background
+    files = history_paths() + [os.path.join(Tools.getCacheDir(), MIRROR_FILE)]
+    if show_favicon:
+        from Favicon import MANIFEST_FILE
+        files.append(os.path.join(Tools.getCacheDir(), MANIFEST_FILE))
+    return files
+
+
 def main():
     # Get wf cached directory for writing into debugger
     wf_cache_dir = Tools.getCacheDir()
@@ -288,9 +356,31 @@ def main():
         Tools.log("Python version 3.7.0 or higher required!")
         sys.exit(0)
 
+    search_term = Tools.getArgv(1)
+    # get search results - if no search term, return top 30 items
+    search_term = search_term if search_term else ""
+    if instant_results:
+        from result_cache import cached_items
+        wf = cached_items("history", search_term, source_files(), get_items)
+    else:
+        wf = get_items(search_term)
+    wf.write()
+
+
+def get_items(search_term: str) -> Items:
+    """
+    Search histories and generate Script Filter items
+
+    Args:
+        search_term (str): search query, empty returns top 30 items
+
+    Returns:
+        Items: Script Filter items
+    """
     # Create Workflow items object
     wf = Items()
-    search_term = Tools.getArgv(1)
+    if result_cache_seconds > 0:
+        wf.setCache(result_cache_seconds, loosereload=True)
     locked_history_dbs = history_paths()
     # if selected browser(s) in config was not found stop here
     if len(locked_history_dbs) == 0:
@@ -300,30 +390,29 @@ def main():
             valid=False
         )
         wf.addItem()
-        wf.write()
-        sys.exit(0)
-    # get search results - if no search term, return top 30 items
-    search_term = search_term if search_term else ""
+        return wf
     results = get_histories(locked_history_dbs, search_term)
+    checkpoint("query")
     # if result the write alfred response
     if len(results) > 0:
         # Cache Favicons
         if show_favicon:
+            from Favicon import Icons
             ico = Icons(results)
         for i in results:
-            url = i[0]
+            url = i.url
             # Safely extract title or domain from URL
-            if i[1]:
-                title = i[1]
+            if i.title:
+                title = i.title
             else:
                 # Try to extract domain, fallback to full URL if it fails
                 try:
                     title = url.split('/')[2]
                 except IndexError:
                     title = url
-            visits = i[2]
-            last_visit = formatTimeStamp(i[3], fmt=DATE_FMT)
-            browser = i[4]
+            visits = i.visits
+            last_visit = formatTimeStamp(i.last_visit, fmt=DATE_FMT)
+            browser = i.browser
             # Combine url and browser with pipe separator
             url_with_browser = f"{url}|{browser}"
             wf.setItem(
@@ -357,8 +446,8 @@ def main():
             arg=f"https://www.google.com/search?q={search_term}",
         )
         wf.addItem()
-    wf.write()
+    return wf
 
 
 if __name__ == "__main__":
-    main()
+    run("history", main)
@@ -0,0 +1,31 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Background processes detached from Alfred's Script Filter process.
+
+The favicon fetcher, the mirror sync and index builders, the result cache
+refresher and the search daemon outlive the run which starts them. They
+run in a new session without stdio, Alfred neither waits for them nor
+kills them when it ends the Script Filter.
+"""
+import os
+import sys
+
+
+def spawn_detached(script: str, *args: str) -> None:
+    """
+    Start a python script as detached process, returns immediately
+
+    Args:
+        script (str): path of the script, e.g. __file__ of the caller
+        args (str): command line arguments of the script
+    """
+    # Only needed when a process is started, keeps startup fast
+    import subprocess
+    subprocess.Popen(
+        [sys.executable, os.path.abspath(script), *args],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
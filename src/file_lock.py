@@ -0,0 +1,119 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Single writer protocol for files in the workflow cache directory.
+
+Overlapping runs of the Script Filters, the search daemon and the
+background processes rebuild the same cached state (favicons, trigram
+indexes, the history mirror, stored results). A writer holds an exclusive
+flock on a lock file next to the file it rebuilds, other processes wait
+for it and reuse its output or leave the work to it. The kernel releases
+the lock when the holder exits or crashes, so there are no leftover claims
+to expire. Files are written to a temp file and renamed over the target,
+readers see either the old or the complete new file.
+"""
+import fcntl
+import os
+import time
+
+# Seconds between two attempts to get a lock held by another process
+POLL_INTERVAL = 0.02
+
+
+class FileLock(object):
+    """
+    Exclusive lock on a lock file, held until released or the process exits
+
+    Args:
+
+        object (obj): -
+
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Lock file, created on first use and never removed (removing it
+        would let two processes lock different files)
+
+        Args:
+            path (str): path to lock file, e.g. "{target}.lock"
+        """
+        self.path = path
+        self.file = None
+
+    def acquire(self, timeout: float = 0) -> bool:
+        """
+        Get the lock, waits for the holder up to timeout seconds
+
+        Args:
+            timeout (float, optional): seconds to wait. Defaults to 0 (do not wait).
+
+        Returns:
+            bool: True if the lock is ours
+        """
+        if self.file is None:
+            self.file = open(self.path, "a")
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.release()
+                    return False
+                time.sleep(min(POLL_INTERVAL, remaining))
+
+    def release(self) -> None:
+        if self.file is not None:
+            # Closing the file releases the lock
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+def is_locked(path: str) -> bool:
+    """
+    Check if a process holds the lock. The check holds a shared lock for
+    an instant, a writer trying to get the lock right then leaves the work
+    to the next run.
+
+    Args:
+        path (str): path to lock file
+
+    Returns:
+        bool: True if the lock is held
+    """
+    try:
+        with open(path, "rb") as f:
+            fcntl.flock(f, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        return False
+    except BlockingIOError:
+        return True
+    except OSError:
+        # No lock file, nobody ever held the lock
+        return False
+
+
+def atomic_write(path: str, data: bytes) -> None:
+    """
+    Write a file, readers see either the old or the complete new file
+
+    Args:
+        path (str): path to file
+        data (bytes): content
+    """
+    tmp = f"{path}.{os.getpid()}"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.path.exists(tmp) and os.remove(tmp)
+        raise
@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Cancellation of Script Filter runs superseded by a newer query.
+
+While typing, runs of a Script Filter overlap although Alfred only shows
+the output of the newest one. Every run writes a new token into the
+generation file of its script in the cache directory and checks it between
+its stages: once another run wrote its token, the run is superseded and
+stops. Superseded is raised, so context managers remove temp files on the
+way out. SIGTERM (Alfred terminating the previous script) is turned into
+the same exit.
+"""
+import os
+import signal
+import sys
+import time
+
+from Alfred3 import Tools
+from file_lock import atomic_write
+
+# Token of this process, None if runs are not tracked (e.g. search daemon)
+_current = None
+
+
+class Superseded(Exception):
+    """
+    A newer run of the same Script Filter started
+    """
+
+
+def _path(script: str) -> str:
+    return os.path.join(Tools.getCacheDir(), f"{script}.generation")
+
+
+def _terminate(signum, frame) -> None:
+    raise Superseded("terminated")
+
+
+def start(script: str) -> None:
+    """
+    Register a new run of a script, supersedes all older runs
+
+    Args:
+        script (str): e.g. "history"
+    """
+    global _current
+    path = _path(script)
+    token = f"{os.getpid()}:{time.time_ns()}"
+    # A run never reads a partial token
+    atomic_write(path, token.encode())
+    _current = (path, token)
+    signal.signal(signal.SIGTERM, _terminate)
+
+
+def checkpoint(stage: str) -> None:
+    """
+    Stop the run if a newer run of the script started
+
+    Args:
+        stage (str): finished stage, e.g. "snapshot"
+
+    Raises:
+        Superseded: if a newer run started
+    """
+    if _current is None:
+        return
+    path, token = _current
+    try:
+        with open(path) as f:
+            current = f.read()
+    except OSError:
+        return
+    if current != token:
+        Tools.log(f"Superseded after {stage}, stopped")
+        raise Superseded(stage)
+
+
+def run(script: str, func) -> None:
+    """
+    Run the main function of a script as a tracked run, a superseded run
+    exits quietly without output
+
+    Args:
+        script (str): e.g. "history"
+        func (function): main function of the script
+    """
+    start(script)
+    try:
+        func()
+    except Superseded:
+        sys.exit(0)
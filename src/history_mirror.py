@@ -0,0 +1,708 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Persistent mirror of the browser history databases.
+
+The mirror is a single SQLite file in the workflow cache directory which
+holds one row per URL and browser. Every source is synced incrementally:
+only rows changed since the last sync are pulled, based on watermarks on
+urls.id/visits.id/last_visit_time (Chromium) resp. history_items.id and
+history_visits.id (Safari). Sources whose files did not change since the
+last sync are not opened at all.
+
+Substring search is narrowed down with a trigram index of the lowercased
+url and title (see trigram.py). Mirror ids only grow (AUTOINCREMENT, an
+updated row gets a new id), so the index stays usable after syncs: it
+covers all rows up to the largest id at build time and newer rows are
+scanned. Once too many rows are not indexed, the index is rebuilt in a
+background process. While a query is typed, the ids matching a previous
+keystroke narrow the search down further (see refine_cache.py); they are
+cached if the index returned only a few candidates.
+"""
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from Alfred3 import Tools
+from detached import spawn_detached
+from file_lock import FileLock
+from matcher import FIELD_SEP
+from host_filter import url_host
+from records import HistoryEntry
+from refine_cache import MAX_IDS, RefinementCache
+from snapshot import open_snapshot
+from sql_filter import SqlFilter, register_functions
+from trigram import TrigramIndex, is_building, write_index
+
+MIRROR_FILE = "history_mirror.db"
+TRIGRAM_FILE = "history_mirror.trigrams"
+# Bump if the mirror schema changes, the mirror gets rebuilt then
+SCHEMA_VERSION = 4
+# Rebuild the trigram index if more than REINDEX_ROWS rows and more than
+# REINDEX_RATIO of the indexed rows are not indexed
+REINDEX_ROWS = 1000
+REINDEX_RATIO = 0.1
+# Seconds to wait for another process syncing the same source
+SYNC_TIMEOUT = 60
+# SQLite VM steps between two checks whether a read in a thread was cancelled
+PROGRESS_STEPS = 10000
+# Scan instead of using the index if it returns more than this share of rows
+MAX_CANDIDATE_RATIO = 0.25
+
+# Key of the row unique_urls() keeps per url in one integer: visits, then
+# last visit (seconds since 1970, 1601 at the earliest), then the first of
+# at most 16 browsers
+UNIQUE_KEY = "(visit_count << 40) + ((CAST(last_visit AS INTEGER) + (1 << 34)) << 4) + 15 - browser_rank"
+
+# Chromium: complete pull of all urls which were visited at least once
+CHROMIUM_FULL = """
+    SELECT urls.id, urls.url, urls.title, urls.visit_count, (urls.last_visit_time/1000000 + (strftime('%s', '1601-01-01'))),
+        EXISTS (SELECT 1 FROM visits WHERE visits.url = urls.id)
+    FROM urls
+"""
+
+# Chromium: urls added or visited since last sync
+CHROMIUM_DELTA = """
+    SELECT urls.id, urls.url, urls.title, urls.visit_count, (urls.last_visit_time/1000000 + (strftime('%s', '1601-01-01'))),
+        EXISTS (SELECT 1 FROM visits WHERE visits.url = urls.id)
+    FROM urls
+    WHERE urls.id > :url_id OR urls.id IN (
+        SELECT visits.url FROM visits
+        WHERE visits.id > :visit_id OR visits.visit_time > :visit_time)
+"""
+
+CHROMIUM_WATERMARK = """
+    SELECT (SELECT MAX(id) FROM urls), (SELECT MAX(id) FROM visits),
+        (SELECT MAX(visit_time) FROM visits), (SELECT COUNT(*) FROM urls)
+"""
+
+# Safari: one row per history item with title of the latest titled visit
+SAFARI_FULL = """
+    SELECT history_items.id, history_items.url, history_visits.title, history_items.visit_count,
+        (MAX(history_visits.visit_time) + 978307200), 1
+    FROM history_items
+        INNER JOIN history_visits
+        ON history_visits.history_item = history_items.id
+    WHERE history_visits.title IS NOT NULL
+    GROUP BY history_items.id
+"""
+
+SAFARI_DELTA = """
+    SELECT history_items.id, history_items.url, history_visits.title, history_items.visit_count,
+        (MAX(history_visits.visit_time) + 978307200), 1
+    FROM history_items
+        INNER JOIN history_visits
+        ON history_visits.history_item = history_items.id
+    WHERE history_visits.title IS NOT NULL AND (
+        history_items.id > :url_id OR history_items.id IN (
+            SELECT history_item FROM history_visits
+            WHERE id > :visit_id OR visit_time > :visit_time))
+    GROUP BY history_items.id
+"""
+
+SAFARI_WATERMARK = """
+    SELECT (SELECT MAX(id) FROM history_items), (SELECT MAX(id) FROM history_visits),
+        (SELECT MAX(visit_time) FROM history_visits), (SELECT COUNT(*) FROM history_items)
+"""
+
+
+def file_signature(db: str) -> str:
+    """
+    Signature of a database file and its WAL sidecar based on inode, size and mtime
+
+    Args:
+        db (str): Path to database file
+
+    Returns:
+        str: Signature string, changes whenever the database was written
+    """
+    parts = list()
+    for f in (db, f"{db}-wal"):
+        try:
+            st = os.stat(f)
+            parts.append(f"{st.st_ino}:{st.st_size}:{st.st_mtime_ns}")
+        except OSError:
+            parts.append("-")
+    return "|".join(parts)
+
+
+class HistoryMirror(object):
+    """
+    Incrementally synced mirror of all configured browser histories
+
+    Args:
+
+        object (obj): -
+
+    """
+
+    def __init__(self, path: str = None) -> None:
+        """
+        Open (or create) the mirror database
+
+        Args:
+            path (str, optional): Path of the mirror file. Defaults to the wf cache directory.
+        """
+        self.path = path if path else os.path.join(
+            Tools.getCacheDir(), MIRROR_FILE)
+        self.trigram_path = os.path.join(
+            os.path.dirname(self.path), TRIGRAM_FILE)
+        self.con = sqlite3.connect(self.path, timeout=5)
+        register_functions(self.con)
+        self._create_schema()
+
+    def close(self) -> None:
+        self.con.close()
+
+    def _create_schema(self) -> None:
+        """
+        Create tables, rebuilds the mirror if schema version changed
+        """
+        version = self.con.execute("PRAGMA user_version").fetchone()[0]
+        if version == SCHEMA_VERSION:
+            return
+        # Ids of the new mirror start again, an old index does not fit
+        os.path.exists(self.trigram_path) and os.remove(self.trigram_path)
+        with self.con:
+            self.con.execute("PRAGMA journal_mode=WAL")
+            self.con.execute("DROP TABLE IF EXISTS history")
+            self.con.execute("DROP TABLE IF EXISTS sources")
+            self.con.execute("""
+                CREATE TABLE history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    browser TEXT NOT NULL,
+                    src_id INTEGER NOT NULL,
+                    url TEXT NOT NULL,
+                    host TEXT NOT NULL,
+                    title TEXT,
+                    visit_count INTEGER,
+                    last_visit INTEGER,
+                    UNIQUE (browser, src_id)
+                )""")
+            self.con.execute("""
+                CREATE TABLE sources (
+                    browser TEXT PRIMARY KEY,
+                    path TEXT,
+                    signature TEXT,
+                    url_id INTEGER,
+                    visit_id INTEGER,
+                    visit_time REAL,
+                    url_count INTEGER
+                )""")
+            self.con.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _state(self, browser: str) -> tuple:
+        """
+        Stored sync state of a browser
+
+        Args:
+            browser (str): Browser name
+
+        Returns:
+            tuple: (path, signature, url_id, visit_id, visit_time, url_count) or None
+        """
+        return self.con.execute(
+            "SELECT path, signature, url_id, visit_id, visit_time, url_count FROM sources WHERE browser = ?",
+            (browser,)).fetchone()
+
+    def is_current(self, db: str, browser: str) -> bool:
+        """
+        Check if mirror of a browser is in sync with the History file without opening it
+
+        Args:
+            db (str): Path to History file
+            browser (str): Browser name
+
+        Returns:
+            bool: True if History file did not change since last sync
+        """
+        state = self._state(browser)
+        return state is not None and state[0] == db and state[1] == file_signature(db)
+
+    def sync(self, sources: list, budget: float = None) -> list:
+        """
+        Pull changes of all outdated sources into the mirror. A source is
+        synced by one process at a time, without budget the others wait
+        for it and use its rows.
+
+        Args:
+            sources (list): list of tuples (History path, Browser name)
+            budget (float, optional): seconds to wait for the sources, the
+                ones not read in time are synced in background. Defaults to None (wait for all).
+
+        Returns:
+            list: browsers which are not synced (yet), their mirror holds the rows of the last sync
+        """
+        outdated = list()
+        late = list()
+        try:
+            for db, browser in sources:
+                lock = FileLock(self.sync_lock(browser))
+                if self.is_current(db, browser):
+                    Tools.log(f"Mirror of {browser} is up to date")
+                elif not lock.acquire(SYNC_TIMEOUT if budget is None else 0):
+                    Tools.log(f"Mirror of {browser} is synced by another process")
+                    late.append(browser)
+                elif self.is_current(db, browser):
+                    lock.release()
+                    Tools.log(f"Mirror of {browser} was synced by another process")
+                else:
+                    outdated.append((db, browser, lock))
+            if budget is None:
+                for db, browser, _ in outdated:
+                    signature = file_signature(db)
+                    self._apply(db, browser, signature, timed_read(db, browser, self._sync_state(db, browser)))
+                return late
+            # Read all sources in parallel, SQLite releases the GIL meanwhile
+            deltas = dict()
+            threads = list()
+            cancelled = threading.Event()
+            for db, browser, _ in outdated:
+                t = threading.Thread(target=read_into, args=(
+                    deltas, db, browser, self._sync_state(db, browser), cancelled), daemon=True)
+                t.start()
+                threads.append(t)
+            deadline = time.perf_counter() + budget
+            for t in threads:
+                t.join(max(0, deadline - time.perf_counter()))
+            # The background sync is the only reader of the slow sources,
+            # their interrupted reads are not part of the results
+            results = dict(deltas)
+            cancelled.set()
+            slow = list()
+            for db, browser, _ in outdated:
+                result = results.get(browser)
+                if result is None:
+                    slow.append((db, browser))
+                    continue
+                signature, delta = result
+                if isinstance(delta, Exception):
+                    raise delta
+                self._apply(db, browser, signature, delta)
+        finally:
+            for _, _, lock in outdated:
+                lock.release()
+        if slow:
+            Tools.log(
+                f"Mirror of {', '.join(b for _, b in slow)} not read within {budget * 1000:.0f} ms, synced in background")
+            # Started after the locks are released, the background sync takes them over
+            sync_in_background(self.path, slow)
+        return late + [b for _, b in slow]
+
+    def _sync_state(self, db: str, browser: str) -> tuple:
+        """
+        Stored sync state of a source
+
+        Args:
+            db (str): Path to History file
+            browser (str): Browser name
+
+        Returns:
+            tuple: sync state or None if the source has to be read completely
+        """
+        state = self._state(browser)
+        return state if state and state[0] == db else None
+
+    def sync_lock(self, browser: str) -> str:
+        """
+        Lock file of the sync of a source
+
+        Args:
+            browser (str): Browser name
+
+        Returns:
+            str: path of the lock file
+        """
+        return f"{self.path}.{browser}.sync.lock"
+
+    def _apply(self, db: str, browser: str, signature: str, delta: dict) -> None:
+        """
+        Write a delta into the mirror
+
+        Args:
+            db (str): Path to History file
+            browser (str): Browser name
+            signature (str): file signature of the History file before reading the delta
+            delta (dict): delta as returned by read_delta()
+        """
+        upserts = list()
+        deletes = list()
+        # Safari shows visits with an empty title (the domain is shown instead)
+        is_safari = "Safari" in db
+        for src_id, url, title, visits, timestamp, visited in delta["rows"]:
+            if url and (title is not None if is_safari else title) and visited:
+                upserts.append((browser, src_id, url, url_host(url), title, visits, timestamp))
+            else:
+                deletes.append((browser, src_id))
+        with self.con:
+            if delta["full"]:
+                self.con.execute(
+                    "DELETE FROM history WHERE browser = ?", (browser,))
+            self.con.executemany(
+                "INSERT OR REPLACE INTO history (browser, src_id, url, host, title, visit_count, last_visit) VALUES (?, ?, ?, ?, ?, ?, ?)", upserts)
+            self.con.executemany(
+                "DELETE FROM history WHERE browser = ? AND src_id = ?", deletes)
+            self.con.execute(
+                "INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (browser, db, signature, *delta["watermark"]))
+        Tools.log(
+            f"Mirror of {browser} synced: {len(upserts)} rows updated, {len(deletes)} removed, full={delta['full']}")
+
+    def query(self, browsers: list, sql_filter: SqlFilter, sort_recent: bool = False, limit: int = None,
+              refinements: RefinementCache = None) -> list:
+        """
+        Get mirrored history entries of given browsers, one per url, ordered
+        by visits or last visit
+
+        Args:
+            browsers (list): list of browser names
+            sql_filter (SqlFilter): search filter
+            sort_recent (bool, optional): order by last visit instead of visits. Defaults to False.
+            limit (int, optional): max entries. Defaults to None.
+            refinements (RefinementCache, optional): cache of recent queries. Defaults to None.
+
+        Returns:
+            list: result list of HistoryEntry
+        """
+        where, params = sql_filter.clause(
+            "host", ("url", "title"), ("visit_count", "last_visit"))
+        browser_column = "browser"
+        refine = refinements is not None and sql_filter.use_and_logic and sql_filter.terms
+        candidates = None
+        if refine:
+            state = self.state(browsers, sql_filter)
+            candidates = refinements.lookup("history", state, sql_filter.terms)
+        if candidates is not None:
+            # Only rows matching a previous keystroke
+            self._store_candidates(candidates)
+            browser_column = "+browser"
+            where = f"id IN temp.candidates AND {where}"
+        else:
+            found = self._index_candidates(sql_filter)
+            if found is not None:
+                watermark, candidates = found
+                self._store_candidates(candidates)
+                # Rows found by the index and rows added after it was built,
+                # the unary + keeps SQLite from scanning all rows of the browser
+                browser_column = "+browser"
+                where = f"(id > ? OR id IN temp.candidates) AND {where}"
+                params = [watermark, *params]
+        if refine and candidates is not None and len(candidates) <= MAX_IDS:
+            # Few matches, cache them for the next keystroke
+            self._store_matches(browsers, where, params)
+            refinements.store("history", state, sql_filter.terms,
+                              [r[0] for r in self.con.execute("SELECT id FROM temp.matches")])
+            browser_column = "+browser"
+            where, params = "id IN temp.matches", []
+        arms = [f"""
+            SELECT url, title, visit_count, last_visit, browser
+            FROM history
+            WHERE {browser_column} = ? AND {where}""" for _ in browsers]
+        start = time.perf_counter()
+        cursor = self.con.execute(
+            unique_urls(arms, sort_recent, limit),
+            [p for browser in browsers for p in (browser, *params)])
+        res = [HistoryEntry(*r) for r in cursor]
+        Tools.log(
+            f"{', '.join(browsers)}: {len(res)} rows in {(time.perf_counter() - start) * 1000:.1f} ms (mirror)")
+        return res
+
+    def _store_matches(self, browsers: list, where: str, params: list) -> None:
+        """
+        Replace the ids in temp table matches by the ids of all matching rows
+
+        Args:
+            browsers (list): list of browser names
+            where (str): compiled search filter, restricted to candidates
+            params (list): parameters of where
+        """
+        with self.con:
+            self.con.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS matches (id INTEGER PRIMARY KEY)")
+            self.con.execute("DELETE FROM temp.matches")
+            self.con.execute(f"""
+                INSERT INTO temp.matches
+                SELECT id FROM history
+                WHERE +browser IN ({','.join('?' * len(browsers))}) AND {where}""", (*browsers, *params))
+
+    def state(self, browsers: list, sql_filter: SqlFilter) -> str:
+        """
+        Sources and settings the rows matching a filter depend on
+
+        Args:
+            browsers (list): list of browser names
+            sql_filter (SqlFilter): search filter
+
+        Returns:
+            str: changes whenever a History file or the ignored domains change
+        """
+        sources = self.con.execute(
+            f"SELECT browser, path, signature FROM sources WHERE browser IN ({','.join('?' * len(browsers))}) ORDER BY browser",
+            browsers).fetchall()
+        return repr((SCHEMA_VERSION, sources, sql_filter.ignored))
+
+    def _index_candidates(self, sql_filter: SqlFilter) -> tuple:
+        """
+        Look up the search terms in the trigram index
+
+        Args:
+            sql_filter (SqlFilter): search filter
+
+        Returns:
+            tuple: (largest indexed id, candidate ids), None if the index cannot narrow down the search
+        """
+        trigrams = self.trigram_index()
+        if trigrams is None:
+            return None
+        try:
+            _, watermark, indexed = trigrams.meta
+            start = time.perf_counter()
+            candidates = trigrams.lookup(sql_filter.index_terms(), sql_filter.use_and_logic)
+            if candidates is None or len(candidates) > indexed * MAX_CANDIDATE_RATIO:
+                return None
+            Tools.log(
+                f"Trigram index: {len(candidates)} candidates in {(time.perf_counter() - start) * 1000:.1f} ms")
+            return watermark, candidates
+        finally:
+            trigrams.close()
+
+    def _store_candidates(self, ids: list) -> None:
+        """
+        Replace the ids in temp table candidates
+
+        Args:
+            ids (list): mirror ids
+        """
+        with self.con:
+            self.con.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS candidates (id INTEGER PRIMARY KEY)")
+            self.con.execute("DELETE FROM temp.candidates")
+            # Multi-row inserts, a statement per id costs three times as much
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                self.con.execute(
+                    f"INSERT INTO temp.candidates VALUES {','.join(['(?)'] * len(chunk))}", chunk)
+
+    def trigram_index(self) -> TrigramIndex:
+        """
+        Map the trigram index of the mirror
+
+        Returns:
+            TrigramIndex: index or None if there is none
+        """
+        trigrams = TrigramIndex.open(self.trigram_path)
+        if trigrams is not None and (not isinstance(trigrams.meta, tuple) or trigrams.meta[0] != SCHEMA_VERSION):
+            trigrams.close()
+            return None
+        return trigrams
+
+    def update_index(self) -> None:
+        """
+        Start a rebuild of the trigram index in background if too many rows
+        are not indexed
+        """
+        trigrams = self.trigram_index()
+        watermark, indexed = (0, 0)
+        if trigrams is not None:
+            _, watermark, indexed = trigrams.meta
+            trigrams.close()
+        new_rows = self.con.execute(
+            "SELECT COUNT(*) FROM history WHERE id > ?", (watermark,)).fetchone()[0]
+        if new_rows > max(REINDEX_ROWS, indexed * REINDEX_RATIO) and not is_building(self.trigram_path):
+            Tools.log(f"Rebuild trigram index in background, {new_rows} rows not indexed")
+            index_in_background(self.path)
+
+    def build_index(self) -> None:
+        """
+        Build the trigram index of lowercased url and title of all rows
+        """
+        start = time.perf_counter()
+        # Read the largest id and the rows within one read transaction
+        self.con.execute("BEGIN")
+        try:
+            watermark, count = self.con.execute(
+                "SELECT IFNULL(MAX(id), 0), COUNT(*) FROM history").fetchone()
+            rows = ((i, f"{url.lower()}{FIELD_SEP}{title.lower()}") for i, url, title in self.con.execute(
+                "SELECT id, url, title FROM history WHERE id <= ? ORDER BY id", (watermark,)))
+            built = write_index(self.trigram_path, rows, (SCHEMA_VERSION, watermark, count))
+        finally:
+            self.con.rollback()
+        if built:
+            Tools.log(
+                f"Trigram index of {count} rows built in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+def order_clause(sort_recent: bool, limit: int = None) -> str:
+    """
+    ORDER BY and LIMIT clause for history rows
+
+    Args:
+        sort_recent (bool): order by last visit instead of visits
+        limit (int, optional): max rows. Defaults to None.
+
+    Returns:
+        str: SQL clause for columns visit_count and last_visit
+    """
+    order_by = "last_visit DESC" if sort_recent else "visit_count DESC, last_visit DESC"
+    limit_clause = f"LIMIT {int(limit)}" if limit else ""
+    return f"ORDER BY {order_by} {limit_clause}"
+
+
+def unique_urls(arms: list, sort_recent: bool, limit: int = None) -> str:
+    """
+    Combine the history rows of several browsers into one row per url in a
+    single statement, so only the final rows are passed to Python. Like
+    removeDuplicates() the row with most visits is kept, on a tie the most
+    recent one and then the one of the first browser.
+
+    Args:
+        arms (list): SELECT statement per browser in order of the browsers,
+            selecting url, title, visit_count, last_visit and browser
+        sort_recent (bool): order by last visit instead of visits
+        limit (int, optional): max rows. Defaults to None.
+
+    Returns:
+        str: SQL statement, parameters are the ones of the arms in order
+    """
+    # A LIMIT per browser is only safe if ranking does not depend on the
+    # row kept for URLs found in multiple browsers
+    if limit and (len(arms) == 1 or not sort_recent):
+        arms = [f"SELECT * FROM ({arm}) {order_clause(sort_recent, limit)}" for arm in arms]
+    union = " UNION ALL ".join(
+        f"SELECT *, {i} AS browser_rank FROM ({arm})" for i, arm in enumerate(arms))
+    # With a single max() the other columns of a group are taken from the
+    # row with the largest key
+    return f"""
+        SELECT url, title, visit_count, last_visit, browser FROM (
+            SELECT url, title, visit_count, last_visit, browser, MAX({UNIQUE_KEY})
+            FROM ({union})
+            GROUP BY url)
+        {order_clause(sort_recent, limit)}"""
+
+
+def timed_read(db: str, browser: str, state: tuple, cancelled: threading.Event = None) -> dict:
+    """
+    read_delta() with its duration logged
+
+    Args:
+        db (str): Path to History file
+        browser (str): Browser name
+        state (tuple): stored sync state or None for a full read
+        cancelled (threading.Event, optional): aborts the read once set. Defaults to None.
+
+    Returns:
+        dict: delta as returned by read_delta()
+    """
+    start = time.perf_counter()
+    delta = read_delta(db, state, cancelled)
+    Tools.log(
+        f"{browser}: {len(delta['rows'])} changed rows read in {(time.perf_counter() - start) * 1000:.1f} ms")
+    return delta
+
+
+def read_into(deltas: dict, db: str, browser: str, state: tuple, cancelled: threading.Event) -> None:
+    """
+    Read the delta of a History file in a thread
+
+    Args:
+        deltas (dict): receives (signature, delta or sqlite3.Error) per browser
+        db (str): Path to History file
+        browser (str): Browser name
+        state (tuple): stored sync state or None for a full read
+        cancelled (threading.Event): aborts the read once set
+    """
+    signature = file_signature(db)
+    try:
+        deltas[browser] = (signature, timed_read(db, browser, state, cancelled))
+    except sqlite3.Error as e:
+        deltas[browser] = (signature, e)
+
+
+def sync_in_background(path: str, sources: list) -> None:
+    """
+    Start a detached process which syncs sources into the mirror
+
+    Args:
+        path (str): Path of the mirror file
+        sources (list): list of tuples (History path, Browser name)
+    """
+    spawn_detached(__file__, path, *(a for pair in sources for a in pair))
+
+
+def background_sync(mirror: HistoryMirror, sources: list) -> None:
+    """
+    Sync sources in background, waits for processes syncing them already
+
+    Args:
+        mirror (HistoryMirror): the mirror
+        sources (list): list of tuples (History path, Browser name)
+    """
+    mirror.sync(sources)
+    mirror.update_index()
+
+
+def index_in_background(path: str) -> None:
+    """
+    Start a detached process which builds the trigram index of the mirror
+
+    Args:
+        path (str): Path of the mirror file
+    """
+    spawn_detached(__file__, path)
+
+
+def read_delta(db: str, state: tuple, cancelled: threading.Event = None) -> dict:
+    """
+    Read all rows changed since last sync from a History file
+
+    Args:
+        db (str): Path to History file
+        state (tuple): stored sync state, None for a full pull
+        cancelled (threading.Event, optional): aborts the read once set. Defaults to None.
+
+    Returns:
+        dict: rows (id, url, title, visits, timestamp, visited), new watermark and full flag
+
+    Raises:
+        sqlite3.OperationalError: if the read was cancelled
+    """
+    is_safari = "Safari" in db
+    with open_snapshot(db) as c:
+        if cancelled is not None:
+            # A running query is interrupted as soon as the read is cancelled
+            c.set_progress_handler(cancelled.is_set, PROGRESS_STEPS)
+        # Read watermark and rows within one read transaction
+        c.execute("BEGIN")
+        watermark = c.execute(
+            SAFARI_WATERMARK if is_safari else CHROMIUM_WATERMARK).fetchone()
+        watermark = tuple(w or 0 for w in watermark)
+        full = True
+        if state:
+            _, _, url_id, visit_id, visit_time, url_count = state
+            new_urls = c.execute(
+                f"SELECT COUNT(*) FROM {'history_items' if is_safari else 'urls'} WHERE id > ?",
+                (url_id,)).fetchone()[0]
+            # Rows were deleted (e.g. history cleared), pull everything again
+            full = watermark[1] < visit_id or watermark[3] != url_count + new_urls
+        if full:
+            rows = c.execute(SAFARI_FULL if is_safari else CHROMIUM_FULL).fetchall()
+        else:
+            rows = c.execute(
+                SAFARI_DELTA if is_safari else CHROMIUM_DELTA,
+                {"url_id": url_id, "visit_id": visit_id, "visit_time": visit_time}).fetchall()
+    return {"rows": rows, "watermark": watermark, "full": full}
+
+
+if __name__ == "__main__":
+    # history_mirror.py <mirror> builds the trigram index,
+    # history_mirror.py <mirror> <History path> <Browser name> ... syncs sources
+    mirror = HistoryMirror(sys.argv[1])
+    try:
+        if len(sys.argv) > 2:
+            background_sync(mirror, list(zip(sys.argv[2::2], sys.argv[3::2])))
+        else:
+            mirror.build_index()
+    finally:
+        mirror.close()
@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Ignored domains matched against the host of a url.
+
+A url is ignored if its host is one of the ignored domains or a subdomain
+of one: "google.com" ignores "mail.google.com" but not
+"https://example.org/?ref=google.com". The ignored domains are compiled
+once into a set; a host is checked by looking up the host and its parent
+domains, one set lookup per label.
+
+Two kinds of entries keep the meaning they had when entries were matched
+as substrings of the url:
+- a keyword without dot (e.g. "facebook") ignores every host containing it,
+- an entry with a path (e.g. "google.com/search") ignores the urls of the
+  domain and its subdomains starting with that path only.
+"""
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+# Compiled ignored_domains setting: sorted tuples of domains, keywords and
+# (domain, path) prefixes
+IgnoredUrls = namedtuple("IgnoredUrls", "domains keywords prefixes")
+NO_IGNORED_URLS = IgnoredUrls((), (), ())
+
+
+def url_host(url: str) -> str:
+    """
+    Lowercased host of a url without user info and port
+
+    Args:
+        url (str): url
+
+    Returns:
+        str: host, empty if the url has none (e.g. about:blank)
+    """
+    try:
+        return urlsplit(url).hostname or ""
+    except ValueError:
+        # e.g. invalid IPv6 address
+        return ""
+
+
+def parse_ignored(value: str) -> IgnoredUrls:
+    """
+    Compile the ignored_domains setting
+
+    Args:
+        value (str): comma separated entries, urls and ports are reduced to the
+            host as url_host() does for the searched urls
+
+    Returns:
+        IgnoredUrls: distinct domains, keywords (entries without dot) and
+            prefixes (entries with a path)
+    """
+    domains = set()
+    keywords = set()
+    prefixes = set()
+    for d in (value or "").split(","):
+        d = d.strip()
+        if not d:
+            continue
+        url = d if "://" in d else f"//{d}"
+        host = url_host(url).lstrip("*").strip(".")
+        try:
+            path = urlsplit(url).path.rstrip("/")
+        except ValueError:
+            path = ""
+        if not host:
+            continue
+        if path:
+            prefixes.add((host, path))
+        elif "." in host:
+            domains.add(host)
+        else:
+            keywords.add(host)
+    return IgnoredUrls(tuple(sorted(domains)), tuple(sorted(keywords)), tuple(sorted(prefixes)))
+
+
+def is_subdomain(host: str, domain: str) -> bool:
+    """
+    Check if a host is a domain or a subdomain of it
+
+    Args:
+        host (str): lowercased host
+        domain (str): lowercased domain
+
+    Returns:
+        bool: True if the host belongs to the domain
+    """
+    return host == domain or host.endswith(f".{domain}")
+
+
+def is_ignored(url: str, ignored: IgnoredUrls) -> bool:
+    """
+    Check if a url is ignored
+
+    Args:
+        url (str): url
+        ignored (IgnoredUrls): compiled setting, domains as set for fast lookups
+
+    Returns:
+        bool: True if the url is ignored
+    """
+    host = url_host(url)
+    label = host
+    while label:
+        if label in ignored.domains:
+            return True
+        label = label.partition(".")[2]
+    if any(k in host for k in ignored.keywords):
+        return True
+    # The path follows the domain right after the scheme or a subdomain
+    return any(is_subdomain(host, d) and (f"://{d}{p}" in url or f".{d}{p}" in url)
+               for d, p in ignored.prefixes)
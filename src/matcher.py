@@ -0,0 +1,183 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Substring matching of search terms against precomputed search keys.
+
+A search key holds the NFC normalized, lowercased fields of a record,
+separated by FIELD_SEP, and is built once when the records are loaded.
+The keys of all records are joined into one text; a term is located with
+str.find() over that text and every hit is mapped back to its record.
+After a hit the scan continues at the next record, so the cost depends on
+the number of matching records instead of calling Python code per record
+and field. If most records match, the remaining keys are tested one by
+one, which is cheaper than a str.find() call per hit. Large record lists
+have a trigram index (see trigram.py): terms of three or more characters
+are then only verified against the records the index returns.
+"""
+import unicodedata
+from bisect import bisect_right
+from itertools import islice
+
+# Separates the fields within a key and the keys within the index text
+FIELD_SEP = "\x1f"
+ROW_SEP = "\x1e"
+# Switch from str.find() to testing every key once at least DENSE_HITS
+# records were found and more than every DENSE_RATIO-th record matched
+DENSE_HITS = 256
+DENSE_RATIO = 16
+
+
+def normalize(text: str, fold_diacritics: bool = False) -> str:
+    """
+    Normalize text for matching: NFC, lowercase and optionally without diacritics
+
+    Args:
+        text (str): text to normalize
+        fold_diacritics (bool, optional): strip combining marks (é → e). Defaults to False.
+
+    Returns:
+        str: normalized text
+    """
+    text = unicodedata.normalize("NFC", text).lower()
+    if fold_diacritics:
+        text = unicodedata.normalize("NFC", "".join(
+            c for c in unicodedata.normalize("NFD", text) if not unicodedata.combining(c)))
+    return text
+
+
+class SearchIndex(object):
+    """
+    Search keys of a record list joined into one text
+
+    Args:
+
+        object (obj): -
+
+    """
+
+    def __init__(self, keys: list, trigrams=None) -> None:
+        """
+        Args:
+            keys (list): search key per record
+            trigrams (TrigramIndex, optional): trigram index of the keys. Defaults to None.
+        """
+        self.keys = keys
+        self.trigrams = trigrams
+        # Joined text, built on first scan
+        self.text = None
+        self.starts = None
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _join(self) -> None:
+        self.text = ROW_SEP.join(self.keys)
+        self.starts = list()
+        pos = 0
+        for k in self.keys:
+            self.starts.append(pos)
+            pos += len(k) + 1
+
+    def rows_with(self, term: str) -> list:
+        """
+        Records containing a term in one of their fields
+
+        Args:
+            term (str): normalized search term
+
+        Returns:
+            list: record indexes in ascending order
+        """
+        if not term:
+            return list(range(len(self.keys)))
+        if FIELD_SEP in term or ROW_SEP in term:
+            return self.filter(range(len(self.keys)), term)
+        if self.trigrams is not None:
+            candidates = self.trigrams.candidates(term)
+            if candidates is not None:
+                return self.filter(candidates, term)
+        if self.text is None:
+            self._join()
+        rows = list()
+        starts = self.starts
+        last = len(starts) - 1
+        find = self.text.find
+        pos = find(term)
+        while pos != -1:
+            row = bisect_right(starts, pos) - 1
+            rows.append(row)
+            if row == last:
+                break
+            if len(rows) >= DENSE_HITS and len(rows) * DENSE_RATIO > row:
+                # Most records match, testing each remaining key is cheaper
+                rows.extend(i for i, k in enumerate(islice(self.keys, row + 1, None), row + 1) if term in k)
+                break
+            # Continue with the next record
+            pos = find(term, starts[row + 1])
+        return rows
+
+    def filter(self, rows: list, term: str) -> list:
+        """
+        Records of given ones which contain a term in one of their fields
+
+        Args:
+            rows (list): record indexes
+            term (str): normalized search term
+
+        Returns:
+            list: record indexes in same order
+        """
+        keys = self.keys
+        if FIELD_SEP in term or ROW_SEP in term:
+            return [i for i in rows if any(term in f for f in keys[i].split(FIELD_SEP))]
+        return [i for i in rows if term in keys[i]]
+
+
+class Matcher(object):
+    """
+    Search terms compiled once per query
+
+    Args:
+
+        object (obj): -
+
+    """
+
+    def __init__(self, terms: list, use_and_logic: bool = True, fold_diacritics: bool = False) -> None:
+        """
+        Args:
+            terms (list): search terms
+            use_and_logic (bool, optional): all terms must match. Defaults to True.
+            fold_diacritics (bool, optional): strip combining marks. Defaults to False.
+        """
+        # Each term once, in given order
+        self.terms = list(dict.fromkeys(normalize(t, fold_diacritics) for t in terms))
+        self.use_and_logic = use_and_logic
+
+    def scan(self, index: SearchIndex, rows: list = None) -> list:
+        """
+        Find all matching records of an index
+
+        Args:
+            index (SearchIndex): index to search in
+            rows (list, optional): ascending record indexes to check instead of all
+                records, AND logic only. Defaults to None.
+
+        Returns:
+            list: record indexes in ascending order
+        """
+        if not self.terms:
+            # all() of no terms matches everything, any() nothing
+            return list(range(len(index))) if self.use_and_logic else []
+        if self.use_and_logic:
+            # Further terms only need to be checked on the matches so far,
+            # start with the longest term which is likely the rarest
+            first, *others = sorted(self.terms, key=len, reverse=True)
+            rows = index.rows_with(first) if rows is None else index.filter(rows, first)
+            for term in others:
+                rows = index.filter(rows, term)
+            return rows
+        rows = set()
+        for term in self.terms:
+            rows.update(index.rows_with(term))
+        return sorted(rows)
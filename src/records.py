@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Record types shared by history and bookmark search.
+
+HistoryEntry and Bookmark are named tuples: they are as small as plain
+tuples, can be sorted and deduplicated like before and give the fields a
+name. Parsed bookmark files are held as BookmarkTable, which stores the
+fields column-wise: no tuple per bookmark, every folder path and the
+browser name exist only once, and Bookmark records are only created for
+bookmarks which are actually used (e.g. matches). The search keys of the
+bookmarks (see matcher.py) are stored alongside.
+"""
+import sys
+from array import array
+from collections import namedtuple
+
+HistoryEntry = namedtuple("HistoryEntry", "url title visits last_visit browser")
+
+Bookmark = namedtuple("Bookmark", "name url path browser")
+
+
+class BookmarkTable(object):
+    """
+    Column-wise storage of the bookmarks of a browser
+
+    Args:
+
+        object (obj): -
+
+    """
+    __slots__ = ("browser", "names", "urls", "folders", "folder_ids", "keys", "index", "origin")
+
+    def __init__(self, browser: str, names: list, urls: list, folders: list, folder_ids: array, keys: list = None) -> None:
+        """
+        Args:
+            browser (str): Browser name
+            names (list): bookmark names
+            urls (list): bookmark urls
+            folders (list): distinct folder paths
+            folder_ids (array): index into folders per bookmark
+            keys (list, optional): search key per bookmark. Defaults to None.
+        """
+        self.browser = sys.intern(browser)
+        self.names = names
+        self.urls = urls
+        self.folders = folders
+        self.folder_ids = folder_ids
+        self.keys = keys
+        # SearchIndex over the keys, built on first search
+        self.index = None
+        # (bookmark file, signature) the bookmarks were parsed from, set when cached
+        self.origin = None
+
+    @classmethod
+    def from_records(cls, records, browser: str) -> "BookmarkTable":
+        """
+        Build table from bookmark records
+
+        Args:
+            records (iterable): bookmarks (name, url, path, browser)
+            browser (str): Browser name
+
+        Returns:
+            BookmarkTable: table with the records in same order
+        """
+        folders = dict()
+        names = list()
+        urls = list()
+        folder_ids = array("I")
+        for name, url, path, _ in records:
+            names.append(name)
+            urls.append(url)
+            folder_ids.append(folders.setdefault(path, len(folders)))
+        return cls(browser, names, urls, list(folders), folder_ids)
+
+    def dump(self) -> tuple:
+        """
+        Table as tuple of marshallable objects
+
+        Returns:
+            tuple: (browser, names, urls, folders, folder ids as bytes, keys)
+        """
+        return (self.browser, self.names, self.urls, self.folders, self.folder_ids.tobytes(), self.keys)
+
+    @classmethod
+    def load(cls, dumped: tuple) -> "BookmarkTable":
+        """
+        Restore table from dump()
+
+        Args:
+            dumped (tuple): as returned by dump()
+
+        Returns:
+            BookmarkTable: restored table
+        """
+        browser, names, urls, folders, folder_ids, keys = dumped
+        ids = array("I")
+        ids.frombytes(folder_ids)
+        return cls(browser, names, urls, folders, ids, keys)
+
+    def __len__(self) -> int:
+        return len(self.urls)
+
+    def __getitem__(self, i: int) -> Bookmark:
+        return Bookmark(self.names[i], self.urls[i], self.folders[self.folder_ids[i]], self.browser)
+
+    def __iter__(self):
+        for i in range(len(self.urls)):
+            yield self[i]
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, BookmarkTable) and self.dump() == other.dump()
@@ -0,0 +1,168 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Cache of the ids matching recent queries, used while a query is typed.
+
+Alfred reruns the Script Filter on every keystroke and a query mostly
+grows: "git", "gith", "githu". Under AND logic every row matching the new
+query matches a previous query whose terms are all contained in the new
+terms, so only the cached ids of that query have to be checked. Entries
+are kept per scope (history or a bookmark file) together with a state
+string of the sources and settings they were computed from, entries of
+another state are never used.
+"""
+import os
+import sqlite3
+import time
+from array import array
+
+from Alfred3 import Tools
+
+CACHE_FILE = "refinements.db"
+# Queries kept per scope
+MAX_ENTRIES = 8
+# Larger id lists are not cached, storing and loading them costs more than
+# the trigram index saves
+MAX_IDS = 5000
+# Separates the terms of a query in the key
+TERM_SEP = "\x1f"
+
+
+def refines(terms: list, cached_terms: list) -> bool:
+    """
+    Check if rows matching all terms match all cached terms as well
+
+    Args:
+        terms (list): terms of the new query
+        cached_terms (list): terms of a cached query
+
+    Returns:
+        bool: True if every cached term is part of a new term
+    """
+    return all(any(c in t for t in terms) for c in cached_terms)
+
+
+class RefinementCache(object):
+    """
+    Recent (query, matching ids) pairs with hit counters
+
+    Args:
+
+        object (obj): -
+
+    """
+
+    def __init__(self, path: str = None) -> None:
+        """
+        Open (or create) the cache
+
+        Args:
+            path (str, optional): Path of the cache file. Defaults to the wf cache directory.
+        """
+        self.path = path if path else os.path.join(
+            Tools.getCacheDir(), CACHE_FILE)
+        # Hits and misses per scope not written yet and the terms of the
+        # entry hit last, both are written by the next store()
+        self.pending = dict()
+        self.hit_terms = dict()
+        self.con = sqlite3.connect(self.path, timeout=5)
+        # A cache, losing the last writes on a crash is fine
+        self.con.execute("PRAGMA synchronous = OFF")
+        with self.con:
+            self.con.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                    scope TEXT NOT NULL,
+                    terms TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    ids BLOB NOT NULL,
+                    used REAL,
+                    PRIMARY KEY (scope, terms)
+                )""")
+            self.con.execute("""
+                CREATE TABLE IF NOT EXISTS counters (
+                    scope TEXT PRIMARY KEY,
+                    hits INTEGER,
+                    misses INTEGER
+                )""")
+
+    def close(self) -> None:
+        self.con.close()
+
+    def lookup(self, scope: str, state: str, terms: list) -> list:
+        """
+        Ids matching a cached query the new query refines, the smallest
+        list if there are several. Reads only, the hit is counted in memory.
+
+        Args:
+            scope (str): e.g. "history"
+            state (str): sources and settings the ids depend on
+            terms (list): normalized search terms, AND logic
+
+        Returns:
+            list: ascending ids or None if nothing was cached
+        """
+        best = None
+        for cached_terms, ids in self.con.execute(
+                "SELECT terms, ids FROM results WHERE scope = ? AND state = ?", (scope, state)):
+            if refines(terms, cached_terms.split(TERM_SEP)) and (best is None or len(ids) < len(best[1])):
+                best = (cached_terms, ids)
+        hits, misses = self.pending.get(scope, (0, 0))
+        self.pending[scope] = (hits + 1, misses) if best else (hits, misses + 1)
+        Tools.log(f"Refinement cache {scope}: {'hit' if best else 'miss'}")
+        if best is None:
+            return None
+        self.hit_terms[scope] = best[0]
+        ids = array("I")
+        ids.frombytes(best[1])
+        return ids.tolist()
+
+    def store(self, scope: str, state: str, terms: list, ids: list) -> None:
+        """
+        Cache the ids matching a query, drops entries of other states and
+        the least recently used entries of the scope. Writes the counters
+        and the use of the entry hit by the last lookup as well.
+
+        Args:
+            scope (str): e.g. "history"
+            state (str): sources and settings the ids depend on
+            terms (list): normalized search terms, AND logic
+            ids (list): ascending ids of all matching rows
+        """
+        hits, misses = self.pending.pop(scope, (0, 0))
+        hit_terms = self.hit_terms.pop(scope, None)
+        if len(ids) > MAX_IDS and not (hits or misses):
+            return
+        now = time.time()
+        with self.con:
+            self.con.execute(
+                "INSERT OR IGNORE INTO counters VALUES (?, 0, 0)", (scope,))
+            self.con.execute(
+                "UPDATE counters SET hits = hits + ?, misses = misses + ? WHERE scope = ?", (hits, misses, scope))
+            if hit_terms is not None:
+                self.con.execute(
+                    "UPDATE results SET used = ? WHERE scope = ? AND terms = ?", (now, scope, hit_terms))
+            if len(ids) > MAX_IDS:
+                return
+            self.con.execute(
+                "DELETE FROM results WHERE scope = ? AND state != ?", (scope, state))
+            self.con.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                (scope, TERM_SEP.join(terms), state, array("I", ids).tobytes(), now))
+            self.con.execute("""
+                DELETE FROM results WHERE scope = ? AND terms NOT IN (
+                    SELECT terms FROM results WHERE scope = ? ORDER BY used DESC LIMIT ?)""",
+                             (scope, scope, MAX_ENTRIES))
+
+    def stats(self, scope: str) -> tuple:
+        """
+        Written hit counters of a scope
+
+        Args:
+            scope (str): e.g. "history"
+
+        Returns:
+            tuple: (hits, misses)
+        """
+        row = self.con.execute(
+            "SELECT hits, misses FROM counters WHERE scope = ?", (scope,)).fetchone()
+        return row if row else (0, 0)
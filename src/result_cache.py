@@ -0,0 +1,289 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Last Script Filter output per query, served while it is refreshed
+(stale-while-revalidate).
+
+An output is stored with the modification times of the files it was
+computed from (History/Bookmarks files incl. WAL sidecars, the favicon
+manifest). If they did not change, the stored output is returned without
+searching at all. If they changed, the stored output is returned marked
+as updating, together with Alfred's rerun, and a background process
+computes the new output. Refreshes are coalesced: only one refresher runs
+at a time and it refreshes just the latest requested query of a script,
+queries requested in between (keystrokes of a burst) are skipped.
+"""
+import importlib
+import json
+import os
+import sqlite3
+import time
+
+from Alfred3 import Items, Tools
+from detached import spawn_detached
+from file_lock import FileLock, is_locked
+
+CACHE_FILE = "results.db"
+LOCK_FILE = "results.refresh.lock"
+# Outputs kept per script
+MAX_ENTRIES = 200
+# Seconds until Alfred reruns the Script Filter while an output is refreshed
+RERUN_SECONDS = 0.5
+# Appended to the subtitles of a stale output
+STALE_MARK = " · updating…"
+# Modules providing get_items() per script
+SCRIPTS = {"history": "chrom_history", "bookmarks": "chrom_bookmarks"}
+
+
+def source_signature(paths: list) -> str:
+    """
+    Modification times and sizes of source files and their WAL sidecars
+
+    Args:
+        paths (list): paths of the files an output is computed from
+
+    Returns:
+        str: changes whenever one of the files changes
+    """
+    signature = list()
+    for p in paths:
+        for f in (p, f"{p}-wal"):
+            try:
+                st = os.stat(f)
+                signature.append((f, st.st_mtime_ns, st.st_size))
+            except OSError:
+                signature.append((f, None, None))
+    return repr(signature)
+
+
+def config_key() -> str:
+    """
+    Workflow configuration an output depends on
+
+    Returns:
+        str: configuration as string
+    """
+    from search_client import get_config
+    return repr(sorted(get_config().items()))
+
+
+class ResultCache(object):
+    """
+    Script Filter outputs per script, query and configuration
+
+    Args:
+
+        object (obj): -
+
+    """
+
+    def __init__(self, path: str = None) -> None:
+        """
+        Open (or create) the cache
+
+        Args:
+            path (str, optional): Path of the cache file. Defaults to the wf cache directory.
+        """
+        self.path = path if path else os.path.join(
+            Tools.getCacheDir(), CACHE_FILE)
+        self.con = sqlite3.connect(self.path, timeout=5)
+        # A cache, losing the last writes on a crash is fine
+        self.con.execute("PRAGMA synchronous = OFF")
+        with self.con:
+            self.con.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                    script TEXT NOT NULL,
+                    query TEXT NOT NULL,
+                    config TEXT NOT NULL,
+                    signature TEXT NOT NULL,
+                    output TEXT NOT NULL,
+                    stored REAL,
+                    requested REAL,
+                    PRIMARY KEY (script, query, config)
+                )""")
+
+    def close(self) -> None:
+        self.con.close()
+
+    def lookup(self, script: str, query: str, config: str) -> tuple:
+        """
+        Stored output of a query
+
+        Args:
+            script (str): e.g. "history"
+            query (str): search query
+            config (str): workflow configuration
+
+        Returns:
+            tuple: (signature, output dict) or None if nothing was stored
+        """
+        row = self.con.execute(
+            "SELECT signature, output FROM results WHERE script = ? AND query = ? AND config = ?",
+            (script, query, config)).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def store(self, script: str, query: str, config: str, signature: str, output: dict) -> None:
+        """
+        Store the output of a query, drops the oldest outputs of the script
+
+        Args:
+            script (str): e.g. "history"
+            query (str): search query
+            config (str): workflow configuration
+            signature (str): source_signature() before the search
+            output (dict): Script Filter output
+        """
+        with self.con:
+            self.con.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, NULL)",
+                (script, query, config, signature, json.dumps(output, separators=(",", ":")), time.time()))
+            self.con.execute("""
+                DELETE FROM results WHERE script = ? AND rowid NOT IN (
+                    SELECT rowid FROM results WHERE script = ? ORDER BY stored DESC LIMIT ?)""",
+                             (script, script, MAX_ENTRIES))
+
+    def request(self, script: str, query: str, config: str) -> None:
+        """
+        Ask for a refresh of a stored output
+
+        Args:
+            script (str): e.g. "history"
+            query (str): search query
+            config (str): workflow configuration
+        """
+        with self.con:
+            self.con.execute(
+                "UPDATE results SET requested = ? WHERE script = ? AND query = ? AND config = ?",
+                (time.time(), script, query, config))
+
+    def latest_request(self, script: str, config: str) -> str:
+        """
+        Latest requested query of a script and drop all other requests
+
+        Args:
+            script (str): e.g. "history"
+            config (str): workflow configuration
+
+        Returns:
+            str: query or None if no refresh is requested
+        """
+        with self.con:
+            row = self.con.execute("""
+                SELECT query FROM results
+                WHERE script = ? AND config = ? AND requested IS NOT NULL
+                ORDER BY requested DESC LIMIT 1""", (script, config)).fetchone()
+            self.con.execute(
+                "UPDATE results SET requested = NULL WHERE script = ?", (script,))
+        return row[0] if row else None
+
+
+def stale_items(output: dict) -> Items:
+    """
+    Items of a stale output, marked as updating and rerun by Alfred
+
+    Args:
+        output (dict): stored Script Filter output
+
+    Returns:
+        Items: Script Filter items
+    """
+    wf = Items()
+    # Not cached by Alfred, the fresh output replaces it
+    wf.items = output.get("items", list())
+    for i, item in enumerate(wf.items):
+        if "subtitle" in item:
+            wf.updateItem(i, "subtitle", STALE_MARK)
+    wf.setRerun(RERUN_SECONDS)
+    return wf
+
+
+def cached_items(script: str, query: str, sources: list, get_items) -> Items:
+    """
+    Script Filter items of a query, stored ones if the sources did not
+    change, stale ones while a refresh runs in background
+
+    Args:
+        script (str): e.g. "history"
+        query (str): search query
+        sources (list): paths of the files the output is computed from
+        get_items (function): computes the Items of a query
+
+    Returns:
+        Items: Script Filter items
+    """
+    cache = ResultCache()
+    try:
+        config = config_key()
+        signature = source_signature(sources)
+        stored = cache.lookup(script, query, config)
+        if stored is not None and stored[0] == signature:
+            Tools.log(f"Result cache {script}: up to date")
+            wf = Items()
+            wf.items = stored[1].get("items", list())
+            wf.cache = stored[1].get("cache")
+            return wf
+        if stored is not None:
+            Tools.log(f"Result cache {script}: stale, refresh in background")
+            cache.request(script, query, config)
+            refresh_in_background()
+            return stale_items(stored[1])
+        wf = get_items(query)
+        cache.store(script, query, config, signature, wf.getItems("dict"))
+        return wf
+    finally:
+        cache.close()
+
+
+def is_refreshing() -> bool:
+    """
+    Check if a refresher is running
+
+    Returns:
+        bool: True if a refresher holds the lock
+    """
+    return is_locked(os.path.join(Tools.getCacheDir(), LOCK_FILE))
+
+
+def refresh_in_background() -> None:
+    """
+    Start a detached refresher process unless one is running already
+    """
+    if is_refreshing():
+        return
+    spawn_detached(__file__)
+
+
+def refresh() -> None:
+    """
+    Compute the outputs of the latest requested queries until no refresh
+    is requested anymore
+    """
+    lock = FileLock(os.path.join(Tools.getCacheDir(), LOCK_FILE))
+    if not lock.acquire():
+        return
+    cache = ResultCache()
+    try:
+        config = config_key()
+        refreshed = True
+        while refreshed:
+            refreshed = False
+            for script, module_name in SCRIPTS.items():
+                query = cache.latest_request(script, config)
+                if query is None:
+                    continue
+                module = importlib.import_module(module_name)
+                signature = source_signature(module.source_files())
+                try:
+                    output = module.get_items(query).getItems("dict")
+                except (Exception, SystemExit) as e:
+                    Tools.log(f"Refresh of {script} '{query}' failed: {e!r}")
+                    continue
+                cache.store(script, query, config, signature, output)
+                refreshed = True
+    finally:
+        cache.close()
+        lock.release()
+
+
+if __name__ == "__main__":
+    refresh()
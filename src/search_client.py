@@ -0,0 +1,158 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Thin client of the search daemon (search_daemon.py).
+
+Only cheap modules are imported here (not even json). If the daemon
+answers, the script filter is done without loading Alfred3, Favicon,
+sqlite3 etc. Otherwise the caller falls back to the in-process search and
+a daemon gets started for the next keystrokes.
+
+Protocol: the request is a single line of fields separated by SEP
+(script, query, then name=value pairs of the configuration). The response
+is a status line ("OK", "RESTART <reason>" or "ERROR <reason>") followed
+by the Script Filter output.
+"""
+# _socket instead of socket: the socket module pulls in selectors and enum,
+# which costs more than the whole round trip to the daemon
+import _socket
+import os
+import sys
+
+from browser_config import HISTORY_MAP
+
+# Workflow variables the search results depend on, a daemon started with
+# other values must not answer
+SETTINGS = (
+    "ignored_domains",
+    "bookmarks_ignored_domains",
+    "show_favicon",
+    "sort_recent",
+    "date_format",
+    "search_operator_default",
+    "fold_diacritics",
+    "result_cache_seconds",
+    "search_budget_ms",
+    "alfred_workflow_cache",
+    "alfred_workflow_data",
+)
+
+# Seconds to wait for the daemon's answer
+TIMEOUT = 10
+# Field separator of requests (ASCII unit separator)
+SEP = "\x1f"
+
+
+def socket_path() -> str:
+    """
+    Path of the daemon's unix domain socket (short enough for AF_UNIX)
+
+    Returns:
+        str: socket path in the user's temp directory
+    """
+    tmp_dir = os.getenv("TMPDIR", "/tmp")
+    return os.path.join(tmp_dir, f"alfred-hist-bookmarks-{os.getuid()}.sock")
+
+
+def get_config() -> dict:
+    """
+    Workflow configuration relevant for search results, values are
+    normalized to fit into a request line
+
+    Returns:
+        dict: variable name and value
+    """
+    config = dict()
+    for k in (*HISTORY_MAP.keys(), *SETTINGS):
+        v = os.getenv(k)
+        config[k] = v.replace(SEP, " ").replace("\n", " ") if v is not None else None
+    return config
+
+
+def encode_request(script: str, query: str, config: dict) -> bytes:
+    """
+    Serialize a request
+
+    Args:
+        script (str): "history"|"bookmarks"
+        query (str): search query
+        config (dict): configuration as returned by get_config()
+
+    Returns:
+        bytes: request line
+    """
+    query = query.replace(SEP, " ").replace("\n", " ")
+    fields = [script, query] + [f"{k}={v}" for k, v in config.items() if v is not None]
+    return f"{SEP.join(fields)}\n".encode()
+
+
+def decode_request(line: bytes) -> tuple:
+    """
+    Parse a request
+
+    Args:
+        line (bytes): request line
+
+    Returns:
+        tuple: (script, query, config)
+    """
+    script, query, *pairs = line.decode().rstrip("\n").split(SEP)
+    config = dict.fromkeys(get_config().keys())
+    config.update(p.split("=", 1) for p in pairs)
+    return script, query, config
+
+
+def daemon_enabled() -> bool:
+    return os.getenv("search_daemon", "1").lower() not in ("0", "false")
+
+
+def start_daemon() -> None:
+    """
+    Start the search daemon in background, detached from Alfred's process
+    """
+    from detached import spawn_detached
+    spawn_detached(os.path.join(os.path.dirname(
+        os.path.abspath(__file__)), "search_daemon.py"))
+
+
+def query_daemon(script: str, query: str) -> bool:
+    """
+    Ask the daemon for the Script Filter output and write it to stdout
+
+    Args:
+        script (str): "history"|"bookmarks"
+        query (str): search query
+
+    Returns:
+        bool: True if the daemon answered, False if the caller needs to search in-process
+    """
+    if not daemon_enabled():
+        return False
+    try:
+        s = _socket.socket(_socket.AF_UNIX, _socket.SOCK_STREAM)
+        try:
+            s.settimeout(TIMEOUT)
+            s.connect(socket_path())
+            s.sendall(encode_request(script, query, get_config()))
+            chunks = list()
+            while True:
+                chunk = s.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        finally:
+            s.close()
+    except (FileNotFoundError, ConnectionRefusedError):
+        start_daemon()
+        return False
+    except OSError as e:
+        sys.stderr.write(f"Search daemon not available: {e}\n")
+        return False
+    status, _, output = b"".join(chunks).partition(b"\n")
+    if status != b"OK":
+        sys.stderr.write(f"Search daemon declined: {status.decode()}\n")
+        if status.startswith(b"RESTART"):
+            start_daemon()
+        return False
+    sys.stdout.buffer.write(output)
+    return True
@@ -0,0 +1,126 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Search daemon for history and bookmark search.
+
+Keeps the search modules, the parsed bookmarks and the history mirror
+loaded and answers queries of search_client over a unix domain socket.
+Source files are checked for changes on every query (mirror sync resp.
+bookmark file signature). The daemon exits when it was idle for
+IDLE_TIMEOUT seconds, when the workflow configuration or the workflow
+code changed.
+"""
+import glob
+import os
+import socket
+import sys
+
+from file_lock import FileLock
+from search_client import decode_request, get_config, socket_path
+
+# Seconds without query until the daemon exits
+IDLE_TIMEOUT = int(os.getenv("search_daemon_idle", "600"))
+# Seconds to wait for a previous daemon to exit
+LOCK_TIMEOUT = 3
+
+
+def code_signature() -> dict:
+    """
+    Modification times of the workflow's python files
+
+    Returns:
+        dict: file path and mtime
+    """
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    return {f: os.path.getmtime(f) for f in glob.glob(os.path.join(src_dir, "*.py"))}
+
+
+class SearchDaemon(object):
+    """
+    Unix socket server answering Script Filter queries
+
+    Args:
+
+        object (obj): -
+
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.config = get_config()
+        self.code = code_signature()
+        self.running = True
+        # Load search modules once, module level config is read from env
+        import chrom_bookmarks
+        import chrom_history
+        self.scripts = {"history": chrom_history,
+                        "bookmarks": chrom_bookmarks}
+
+    def handle(self, line: bytes) -> str:
+        """
+        Answer a single request
+
+        Args:
+            line (bytes): request line of the client
+
+        Returns:
+            str: status line and Script Filter output
+        """
+        script_name, query, config = decode_request(line)
+        if config != self.config:
+            self.running = False
+            return "RESTART workflow configuration changed\n"
+        if code_signature() != self.code:
+            self.running = False
+            return "RESTART workflow was updated\n"
+        script = self.scripts.get(script_name)
+        if script is None:
+            return f"ERROR unknown script {script_name}\n"
+        try:
+            return f"OK\n{script.get_items(query).getItems()}"
+        except (Exception, SystemExit) as e:
+            return f"ERROR search failed: {e!r}\n"
+
+    def serve(self) -> None:
+        """
+        Accept queries until idle timeout or shutdown
+        """
+        os.path.exists(self.path) and os.remove(self.path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        os.chmod(self.path, 0o600)
+        server.listen(8)
+        server.settimeout(IDLE_TIMEOUT)
+        try:
+            while self.running:
+                try:
+                    conn, _ = server.accept()
+                except socket.timeout:
+                    break
+                with conn:
+                    conn.settimeout(5)
+                    try:
+                        request = conn.makefile("rb").readline()
+                        conn.sendall(self.handle(request).encode())
+                        # Signal EOF even if a forked child still holds the socket
+                        conn.shutdown(socket.SHUT_WR)
+                    except (OSError, ValueError):
+                        # Client went away (e.g. Alfred cancelled the script filter)
+                        pass
+        finally:
+            server.close()
+            os.path.exists(self.path) and os.remove(self.path)
+
+
+def main():
+    path = socket_path()
+    # Only one daemon runs, a new one waits for the previous one to exit
+    lock = FileLock(f"{path}.lock")
+    if not lock.acquire(LOCK_TIMEOUT):
+        sys.exit(0)
+    with lock:
+        SearchDaemon(path).serve()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Read access to (locked) browser databases.
+
+Browsers keep their History database open while running. Depending on the
+browser the file is locked exclusively (Chromium) or written in WAL mode
+(Safari). open_snapshot() tries the cheapest strategy that works:
+
+    ro:         open the original file read-only, sees WAL contents
+    immutable:  open the original file without locking, only used if there
+                is no pending WAL (nothing would be missed)
+    copy:       copy database and WAL sidecar into a temp directory which
+                is removed in any case
+
+open_snapshots() attaches several databases to one connection with the
+same strategies, so they can be queried together in a single statement.
+"""
+import atexit
+import os
+import sqlite3
+from contextlib import contextmanager
+
+from Alfred3 import Tools
+
+STRATEGIES = ("ro", "immutable", "copy")
+# Temp directories of open snapshots, removed at exit at the latest (a run
+# can exit while a thread still reads a snapshot)
+_tmp_dirs = set()
+# Max number of databases SQLite attaches to one connection (default build)
+MAX_ATTACHED = 10
+
+
+def _uri(path: str, **params: str) -> str:
+    """
+    SQLite URI for a file path
+
+    Args:
+        path (str): Path to database file
+        params (str): URI query parameters e.g. mode="ro"
+
+    Returns:
+        str: file: URI
+    """
+    query = "&".join(f"{k}={v}" for k, v in params.items())
+    # Only these characters have a special meaning in the path of a SQLite URI
+    path = path.replace("%", "%25").replace("?", "%3f").replace("#", "%23")
+    return f"file:{path}?{query}"
+
+
+def has_pending_wal(db: str) -> bool:
+    """
+    Check if the database has a non empty WAL sidecar
+
+    Args:
+        db (str): Path to database file
+
+    Returns:
+        bool: True if WAL file exists and contains frames
+    """
+    try:
+        return os.path.getsize(f"{db}-wal") > 0
+    except OSError:
+        return False
+
+
+def _probe(con: sqlite3.Connection) -> sqlite3.Connection:
+    """
+    Run a cheap read to find out whether the database is accessible
+
+    Args:
+        con (sqlite3.Connection): connection to check
+
+    Returns:
+        sqlite3.Connection: same connection
+    """
+    try:
+        con.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+    except sqlite3.Error:
+        con.close()
+        raise
+    return con
+
+
+def _open_ro(db: str) -> sqlite3.Connection:
+    return _probe(sqlite3.connect(_uri(db, mode="ro"), uri=True, timeout=0))
+
+
+def _open_immutable(db: str) -> sqlite3.Connection:
+    if has_pending_wal(db):
+        raise sqlite3.OperationalError("pending WAL would be ignored")
+    return _probe(sqlite3.connect(_uri(db, mode="ro", immutable="1"), uri=True))
+
+
+def _make_tmp_dir() -> str:
+    import tempfile
+    tmp_dir = tempfile.mkdtemp(prefix="alfred-hist-")
+    _tmp_dirs.add(tmp_dir)
+    return tmp_dir
+
+
+@atexit.register
+def _remove_tmp_dirs(*tmp_dirs: str) -> None:
+    """
+    Remove temp directories of snapshots
+
+    Args:
+        tmp_dirs (str): directories, all remaining ones if none given
+    """
+    tmp_dirs = tmp_dirs or tuple(_tmp_dirs)
+    if not tmp_dirs:
+        return
+    import shutil
+    for tmp_dir in tmp_dirs:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        _tmp_dirs.discard(tmp_dir)
+
+
+def _copy(db: str, target_dir: str) -> str:
+    """
+    Copy database incl. WAL sidecar into target directory
+
+    Args:
+        db (str): Path to database file
+        target_dir (str): directory to copy into
+
+    Returns:
+        str: path of the copied database
+    """
+    import shutil
+    target = os.path.join(target_dir, os.path.basename(db))
+    shutil.copyfile(db, target)
+    if has_pending_wal(db):
+        shutil.copyfile(f"{db}-wal", f"{target}-wal")
+    return target
+
+
+@contextmanager
+def open_snapshot(db: str, strategies: tuple = STRATEGIES):
+    """
+    Open a consistent read-only view of a browser database
+
+    Args:
+        db (str): Path to database file
+        strategies (tuple, optional): strategies to try in order. Defaults to STRATEGIES.
+
+    Yields:
+        sqlite3.Connection: connection to the database or its snapshot
+    """
+    con = None
+    tmp_dir = None
+    try:
+        for strategy in strategies:
+            try:
+                if strategy == "ro":
+                    con = _open_ro(db)
+                elif strategy == "immutable":
+                    con = _open_immutable(db)
+                elif strategy == "copy":
+                    tmp_dir = _make_tmp_dir()
+                    con = _probe(sqlite3.connect(_copy(db, tmp_dir)))
+            except sqlite3.Error as e:
+                Tools.log(f"Snapshot '{strategy}' not possible for {db}: {e}")
+                continue
+            Tools.log(f"Snapshot '{strategy}' used for {db}")
+            break
+        if con is None:
+            raise sqlite3.OperationalError(f"Unable to open {db}")
+        yield con
+    finally:
+        if con is not None:
+            con.close()
+        if tmp_dir:
+            _remove_tmp_dirs(tmp_dir)
+
+
+def _attach(con: sqlite3.Connection, db: str, schema: str, strategy: str, tmp_dir: str) -> None:
+    """
+    Attach a database with the given strategy and check it is accessible
+
+    Args:
+        con (sqlite3.Connection): connection opened with uri=True
+        db (str): Path to database file
+        schema (str): schema name of the attached database
+        strategy (str): one of STRATEGIES
+        tmp_dir (str): directory for copies
+    """
+    if strategy == "ro":
+        target = _uri(db, mode="ro")
+    elif strategy == "immutable":
+        if has_pending_wal(db):
+            raise sqlite3.OperationalError("pending WAL would be ignored")
+        target = _uri(db, mode="ro", immutable="1")
+    else:
+        # All Chromium databases are named History, one directory per copy
+        copy_dir = os.path.join(tmp_dir, schema)
+        os.mkdir(copy_dir)
+        target = _copy(db, copy_dir)
+    con.execute("ATTACH DATABASE ? AS " + schema, (target,))
+    try:
+        con.execute(f"SELECT COUNT(*) FROM {schema}.sqlite_master").fetchone()
+    except sqlite3.Error:
+        con.execute("DETACH DATABASE " + schema)
+        raise
+
+
+@contextmanager
+def open_snapshots(dbs: list, strategies: tuple = STRATEGIES):
+    """
+    Open consistent read-only views of several browser databases in one
+    connection, attached as schemas db0, db1, ... in order of dbs
+
+    Args:
+        dbs (list): Paths to database files, at most MAX_ATTACHED
+        strategies (tuple, optional): strategies to try in order. Defaults to STRATEGIES.
+
+    Yields:
+        sqlite3.Connection: connection with all databases attached
+    """
+    con = sqlite3.connect(":memory:", uri=True, timeout=0)
+    tmp_dir = _make_tmp_dir()
+    try:
+        for i, db in enumerate(dbs):
+            for strategy in strategies:
+                try:
+                    _attach(con, db, f"db{i}", strategy, tmp_dir)
+                except (sqlite3.Error, OSError) as e:
+                    Tools.log(f"Snapshot '{strategy}' not possible for {db}: {e}")
+                    continue
+                Tools.log(f"Snapshot '{strategy}' used for {db}")
+                break
+            else:
+                raise sqlite3.OperationalError(f"Unable to open {db}")
+        yield con
+    finally:
+        con.close()
+        _remove_tmp_dirs(tmp_dir)
@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Compile search terms into parameterized SQL predicates.
+
+A row matches a term if the lowercased term is contained in the lowercased
+url or title (or in the visit count/timestamp for numeric terms), exactly
+like the former Python filter. SQLite's LIKE is only case insensitive for
+ASCII, so non-ASCII terms are compared with Python's str.lower() through a
+registered SQL function. Ignored domains are compared with the host of
+the url (see host_filter.py).
+"""
+import sqlite3
+
+from host_filter import NO_IGNORED_URLS, IgnoredUrls, url_host
+
+# The only non-ASCII characters which lowercase to ASCII letters (İ → i̇,
+# Kelvin sign → k). Rows containing them are compared with str.lower()
+# as LIKE would miss them.
+LOWER_TO_ASCII = ("\u0130", "\u212a")
+NUMERIC_CHARS = set("0123456789.-")
+
+
+def register_functions(con: sqlite3.Connection) -> None:
+    """
+    Register Python functions used by the compiled predicates
+
+    Args:
+        con (sqlite3.Connection): Connection to register the functions on
+    """
+    con.create_function("py_lower", 1, lambda s: s.lower() if isinstance(
+        s, str) else s, deterministic=True)
+    con.create_function("py_host", 1, lambda s: url_host(s) if isinstance(
+        s, str) else "", deterministic=True)
+
+
+def _escape_like(term: str) -> str:
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+class SqlFilter(object):
+    """
+    Search terms and ignored domains compiled into a WHERE clause
+
+    Args:
+
+        object (obj): -
+
+    """
+
+    def __init__(self, terms: list, use_and_logic: bool = True, ignored: IgnoredUrls = None) -> None:
+        """
+        Args:
+            terms (list): search terms as returned by get_search_terms()
+            use_and_logic (bool, optional): all terms must match. Defaults to True.
+            ignored (IgnoredUrls, optional): urls which are dropped, as returned by
+                parse_ignored(). Defaults to None.
+        """
+        self.terms = [t.lower() for t in terms]
+        self.use_and_logic = use_and_logic
+        self.ignored = ignored or NO_IGNORED_URLS
+
+    def index_terms(self) -> list:
+        """
+        Terms to look up in a trigram index of lowercased url and title.
+        Numeric terms are empty as they match visit counts and timestamps too.
+
+        Returns:
+            list: search terms
+        """
+        return ["" if set(t) <= NUMERIC_CHARS else t for t in self.terms]
+
+    def _term_clause(self, term: str, text_columns: tuple, number_columns: tuple) -> tuple:
+        """
+        Predicate for a single term, matching any of the columns
+
+        Returns:
+            tuple: (sql, params)
+        """
+        predicates = list()
+        params = list()
+        for col in text_columns:
+            if term.isascii():
+                predicates.append(
+                    f"({col} LIKE ? ESCAPE '\\' OR ((instr({col}, ?) > 0 OR instr({col}, ?) > 0) AND instr(py_lower({col}), ?) > 0))")
+                params.extend([f"%{_escape_like(term)}%", *LOWER_TO_ASCII, term])
+            else:
+                predicates.append(f"instr(py_lower({col}), ?) > 0")
+                params.append(term)
+        if set(term) <= NUMERIC_CHARS:
+            for col in number_columns:
+                predicates.append(f"instr(CAST({col} AS TEXT), ?) > 0")
+                params.append(term)
+        return f"({' OR '.join(predicates)})", params
+
+    def clause(self, host_column: str, text_columns: tuple, number_columns: tuple = ()) -> tuple:
+        """
+        Build WHERE clause (without WHERE keyword)
+
+        Args:
+            host_column (str): column or expression with the host of the url, used for ignored domains
+            text_columns (tuple): text columns to search in, the url first (e.g. url, title)
+            number_columns (tuple, optional): numeric columns to search in. Defaults to ().
+
+        Returns:
+            tuple: (sql, params)
+        """
+        predicates = list()
+        params = list()
+        if self.terms:
+            term_predicates = list()
+            for term in self.terms:
+                p, prm = self._term_clause(term, text_columns, number_columns)
+                term_predicates.append(p)
+                params.extend(prm)
+            joiner = " AND " if self.use_and_logic else " OR "
+            predicates.append(f"({joiner.join(term_predicates)})")
+        elif not self.use_and_logic:
+            # any() of no terms never matches
+            predicates.append("0")
+        for domain in self.ignored.domains:
+            # Neither the domain nor a subdomain of it
+            predicates.append(f"{host_column} != ? AND substr({host_column}, ?) != ?")
+            params.extend([domain, -len(domain) - 1, f".{domain}"])
+        for keyword in self.ignored.keywords:
+            predicates.append(f"instr({host_column}, ?) = 0")
+            params.append(keyword)
+        for domain, path in self.ignored.prefixes:
+            # The path follows the domain right after the scheme or a subdomain
+            predicates.append(
+                f"NOT (({host_column} = ? OR substr({host_column}, ?) = ?)"
+                f" AND (instr({text_columns[0]}, ?) > 0 OR instr({text_columns[0]}, ?) > 0))")
+            params.extend([domain, -len(domain) - 1, f".{domain}", f"://{domain}{path}", f".{domain}{path}"])
+        if not predicates:
+            return "1", params
+        return " AND ".join(predicates), params
@@ -0,0 +1,296 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Trigram index for substring search, stored in the workflow cache directory.
+
+Every three consecutive characters of a search key are a trigram. The index
+file holds the sorted trigrams and one posting list per trigram, the
+ascending ids of all rows whose key contains it, as plain uint32 arrays.
+The file is memory-mapped and the arrays are used in place, so opening an
+index does not read it and a lookup only touches the posting lists of the
+term's trigrams. A row containing a term contains all trigrams of the
+term; the intersection of their posting lists is a superset of the
+matching rows which the caller verifies. Terms shorter than MIN_TERM
+characters have no trigram and have to be matched by a scan.
+
+File layout (native byte order): header (HEADER), marshalled meta data,
+padding to 8 bytes, trigram codes (uint64), posting list offsets
+(uint32, one more than trigrams), posting lists (uint32).
+"""
+import marshal
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+
+from file_lock import FileLock, is_locked
+
+MAGIC = b"TRG1"
+# magic, trigram count, posting count, meta data length
+HEADER = struct.Struct("=4sIII")
+MIN_TERM = 3
+# Seconds to wait for another process building the same index
+BUILD_TIMEOUT = 10
+# Probe a posting list with binary search if it is PROBE_RATIO times longer
+# than the candidates, otherwise convert it into a set
+PROBE_RATIO = 16
+
+
+def trigram_code(trigram: str) -> int:
+    """
+    Trigram as integer, unicode code points have at most 21 bits
+
+    Args:
+        trigram (str): three characters
+
+    Returns:
+        int: code used as key in the index file
+    """
+    return (ord(trigram[0]) << 42) | (ord(trigram[1]) << 21) | ord(trigram[2])
+
+
+def trigrams(text: str) -> set:
+    """
+    Distinct trigrams of a text
+
+    Args:
+        text (str): search key or term
+
+    Returns:
+        set: strings of three characters
+    """
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def is_building(path: str) -> bool:
+    """
+    Check if another process is building the index
+
+    Args:
+        path (str): path to index file
+
+    Returns:
+        bool: True if a builder holds the lock of the index
+    """
+    return is_locked(f"{path}.lock")
+
+
+def wait_for_build(path: str, timeout: float = BUILD_TIMEOUT) -> None:
+    """
+    Wait until another process finished building the index
+
+    Args:
+        path (str): path to index file
+        timeout (float, optional): max. seconds to wait. Defaults to BUILD_TIMEOUT.
+    """
+    lock = FileLock(f"{path}.lock")
+    lock.acquire(timeout)
+    lock.release()
+
+
+def write_index(path: str, rows, meta=None) -> bool:
+    """
+    Build the trigram index of rows and write it, readers see either the
+    old or the complete new index
+
+    Args:
+        path (str): path to index file
+        rows (iterable): (row id, search key) in ascending order of row ids
+        meta (object, optional): marshallable data stored with the index. Defaults to None.
+
+    Returns:
+        bool: False if another process is building the index
+    """
+    lock = FileLock(f"{path}.lock")
+    if not lock.acquire():
+        return False
+    part = f"{path}.part"
+    try:
+        postings = dict()
+        for row, key in rows:
+            for t in trigrams(key):
+                p = postings.get(t)
+                if p is None:
+                    postings[t] = p = array("I")
+                p.append(row)
+        postings = sorted((trigram_code(t), p) for t, p in postings.items())
+        codes = array("Q")
+        offsets = array("I", [0])
+        for code, p in postings:
+            codes.append(code)
+            offsets.append(offsets[-1] + len(p))
+        meta_data = marshal.dumps(meta)
+        with open(part, "wb") as f:
+            f.write(HEADER.pack(MAGIC, len(codes), offsets[-1], len(meta_data)))
+            f.write(meta_data)
+            f.write(b"\0" * (-(HEADER.size + len(meta_data)) % 8))
+            f.write(codes.tobytes())
+            f.write(offsets.tobytes())
+            for _, p in postings:
+                f.write(p.tobytes())
+        os.replace(part, path)
+    except BaseException:
+        os.path.exists(part) and os.remove(part)
+        raise
+    finally:
+        lock.release()
+    return True
+
+
+def _intersect(rows: list, postings) -> list:
+    """
+    Rows contained in a posting list. A long posting list is probed with
+    binary search, a similar sized one is converted into a set.
+
+    Args:
+        rows (list): ascending row ids
+        postings (memoryview): ascending row ids
+
+    Returns:
+        list: ascending row ids
+    """
+    n = len(postings)
+    if len(rows) * PROBE_RATIO > n:
+        contained = set(postings)
+        return [r for r in rows if r in contained]
+    res = list()
+    lo = 0
+    for r in rows:
+        lo = bisect_left(postings, r, lo)
+        if lo == n:
+            break
+        if postings[lo] == r:
+            res.append(r)
+    return res
+
+
+class TrigramIndex(object):
+    """
+    Memory-mapped trigram index file
+
+    Args:
+
+        object (obj): -
+
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Map an index file
+
+        Args:
+            path (str): path to index file
+
+        Raises:
+            OSError: file missing or not an index file
+        """
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = view = memoryview(self._map)
+        try:
+            magic, n_codes, n_postings, meta_len = HEADER.unpack_from(view)
+            start = HEADER.size + meta_len
+            start += -start % 8
+            if magic != MAGIC or len(view) != start + 12 * n_codes + 4 + 4 * n_postings:
+                raise ValueError("no trigram index")
+            self.meta = marshal.loads(view[HEADER.size:HEADER.size + meta_len])
+        except (struct.error, ValueError, EOFError, TypeError) as e:
+            view.release()
+            self._map.close()
+            raise OSError(f"Invalid trigram index {path}: {e}") from e
+        self.codes = view[start:start + 8 * n_codes].cast("Q")
+        start += 8 * n_codes
+        self.offsets = view[start:start + 4 * (n_codes + 1)].cast("I")
+        start += 4 * (n_codes + 1)
+        self.postings_data = view[start:].cast("I")
+
+    def close(self) -> None:
+        for view in (self.codes, self.offsets, self.postings_data, self._view):
+            view.release()
+        self._map.close()
+
+    @classmethod
+    def open(cls, path: str) -> "TrigramIndex":
+        """
+        Map an index file if there is a valid one
+
+        Args:
+            path (str): path to index file
+
+        Returns:
+            TrigramIndex: index or None
+        """
+        try:
+            return cls(path)
+        except (OSError, ValueError):
+            return None
+
+    def postings(self, trigram: str) -> memoryview:
+        """
+        Posting list of a trigram
+
+        Args:
+            trigram (str): three characters
+
+        Returns:
+            memoryview: ascending row ids, empty if no row contains the trigram
+        """
+        code = trigram_code(trigram)
+        i = bisect_left(self.codes, code)
+        if i == len(self.codes) or self.codes[i] != code:
+            return self.postings_data[0:0]
+        return self.postings_data[self.offsets[i]:self.offsets[i + 1]]
+
+    def _rows_with_all(self, trigram_set: set) -> list:
+        """
+        Rows containing all given trigrams, the shortest posting list is
+        the start and the others are only probed
+
+        Args:
+            trigram_set (set): trigrams
+
+        Returns:
+            list: ascending row ids
+        """
+        lists = sorted((self.postings(t) for t in trigram_set), key=len)
+        rows = lists[0].tolist()
+        for p in lists[1:]:
+            if not rows:
+                break
+            rows = _intersect(rows, p)
+        return rows
+
+    def candidates(self, term: str) -> list:
+        """
+        Rows which may contain a term
+
+        Args:
+            term (str): search term, normalized like the indexed keys
+
+        Returns:
+            list: ascending row ids or None if the term is too short
+        """
+        if len(term) < MIN_TERM:
+            return None
+        return self._rows_with_all(trigrams(term))
+
+    def lookup(self, terms: list, use_and_logic: bool = True) -> list:
+        """
+        Rows which may match a query
+
+        Args:
+            terms (list): search terms, normalized like the indexed keys
+            use_and_logic (bool, optional): all terms must match. Defaults to True.
+
+        Returns:
+            list: ascending row ids or None if the index cannot narrow down the query
+        """
+        usable = [t for t in terms if len(t) >= MIN_TERM]
+        if not usable or (not use_and_logic and len(usable) < len(terms)):
+            # A short term matches rows the index does not know of
+            return None
+        if use_and_logic:
+            # All trigrams of all terms, the rarest one first
+            return self._rows_with_all(set().union(*map(trigrams, usable)))
+        return sorted(set().union(*map(self.candidates, usable)))